@@ -0,0 +1,12 @@
+"""
+Analytics reports over the scraped keystrokes. Each module is a library of
+query and plotting functions with a main(args) for the command line:
+
+    python -m analytics keyboard_visuals
+    python -m analytics improvement --users 12 6
+    python -m analytics spatial_analysis --user 5
+    python -m analytics dvorak_comparison
+
+Importing a module has no side effects; matplotlib and IPython are only
+imported once something is plotted or displayed.
+"""
@@ -0,0 +1,26 @@
+import os
+import logging
+import argparse
+import importlib
+
+import analytics.common
+
+REPORTS = ["keyboard_visuals", "improvement", "spatial_analysis", "dvorak_comparison"]
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(prog="python -m analytics")
+    arg_parser.add_argument("--db", default=None, help="sqlite:///path.db for a local file, default $TYPESCRAPER_DB or postgres")
+    arg_parser.add_argument("--show", action="store_true", help="show figures as well as saving them")
+    reports = arg_parser.add_subparsers(dest="report", required=True)
+    modules = {}
+    for name in REPORTS:
+        modules[name] = importlib.import_module(f"analytics.{name}")
+        modules[name].add_arguments(reports.add_parser(name))
+    args = arg_parser.parse_args()
+
+    if not args.show:
+        os.environ.setdefault("MPLBACKEND", "Agg")
+    analytics.common.SHOW = args.show
+    logging.basicConfig(level=logging.INFO)
+    modules[args.report].main(args)
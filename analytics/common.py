@@ -0,0 +1,54 @@
+import os
+import logging
+
+from utils.cache import QueryCache
+from utils.storage import get_storage
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+IMAGE_DIR = os.path.join(BASE_DIR, "images")
+
+logger = logging.getLogger("analytics")
+
+# Whether figures are shown as well as saved; the command line turns this
+# off unless --show is given.
+SHOW = True
+
+
+def connect(db=None):
+    """Query cache over the storage named by db (as for get_storage)."""
+    return QueryCache(get_storage(db))
+
+
+def pyplot():
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def keyboard(name):
+    from keyboard import Keyboard
+    return Keyboard(os.path.join(BASE_DIR, f"configs/{name}/{name}_config.json"))
+
+
+def legend_marker(color, label):
+    from matplotlib.lines import Line2D
+    return Line2D([0], [0], color='w', markerfacecolor=color, alpha=0.5, marker='o', markersize=15, label=label)
+
+
+def show():
+    if SHOW:
+        pyplot().show()
+
+
+def savefig(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pyplot().savefig(path)
+
+
+def display(obj):
+    """IPython's display when it is installed, else print."""
+    try:
+        from IPython.display import display as ipython_display
+    except ImportError:
+        print(obj)
+        return
+    ipython_display(obj)
@@ -1,53 +1,22 @@
 import os
-import logging
 
-from keyboard import Keyboard
-
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-import psycopg2
 import pandas as pd
-import pandas.io.sql as psql
-from IPython.display import display
-
-logging.basicConfig()
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-conn = psycopg2.connect(dbname="typeracer", user="typescraper")
-
-base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
-image_dir = os.path.join(base_dir, "images")
 
-q_kb = Keyboard(os.path.join(base_dir, "configs/qwerty/qwerty_config.json"))
+from analytics.common import IMAGE_DIR, connect, display, logger, pyplot, savefig, show
+from utils.aggregates import bigram_stats
 
-qwerty = psql.read_sql("select * from qwerty", conn)
+USERS = [12, 6, 19, 8]
 
-def get_char_transitions(user):
-    query = """
-        select ch_prev, ch, ms, race_date
-        from keystrokes
-        where forward 
-              and forward_prev
-              and user_id = %s
-              and seq_index > 1
-    """
-    return psql.read_sql(query, conn, params=[user])
 
+def get_daily_latency(cache, user, chars):
+    stats = bigram_stats(cache, user, by_day=True)
+    stats = stats[stats.ch_prev.isin(chars) & stats.ch.isin(chars)]
+    daily = stats.groupby("day")[["sum", "count"]].sum().reset_index()
+    daily["ms"] = daily["sum"] / daily["count"]
+    return daily.rename(columns={"day": "race_date"})[["race_date", "ms"]]
 
-def get_transition_data(user):
-    transitions = get_char_transitions(user)
-    data = transitions.merge(
-        qwerty, left_on="ch_prev", right_on="ch", suffixes=["_next", ""]
-    )
-    del data["ch"]
-    data = data.merge(
-        qwerty, left_on="ch_next", right_on="ch", suffixes=["_prev", "_next"]
-    )
-    del data["ch"]
-    return data
 
-
-def get_wpm_data(user):
+def get_wpm_data(cache, user):
     query = """
         select race_date, avg(wpm) as wpm, avg(accuracy) as accuracy
         from wpm
@@ -55,29 +24,32 @@ def get_wpm_data(user):
         group by race_date
         order by race_date
     """
-    return psql.read_sql(query, conn, params=[user])
+    return cache.read_sql(query, params=[user], user=user)
+
 
-def get_mistake_data(user):
+def get_mistake_data(cache, user):
     query = """
-        select date(race_date) as race_date,
-               cast(sum(ms * (1 - forward::int)) as float) / sum(ms) as mistake_score
-        from keystrokes 
+        select date(race_date) as race_date, mistake_score
+        from race_summary
         where user_id = %s
-        group by race_date
     """
-    return psql.read_sql(query, conn, params=[user])
+    return cache.read_sql(query, params=[user], user=user)
+
 
-for user in [12, 6, 19, 8]:
-    logger.info(f"Generating graphs for user {user}")
-    ts = get_transition_data(user) 
-    ts.race_date = pd.to_datetime(ts.race_date.dt.date)
-    ts = ts.groupby("race_date").ms.mean().reset_index()
+def get_improvement_data(cache, user, chars):
+    """Daily WPM, accuracy, latency and mistake score for one user."""
+    ts = get_daily_latency(cache, user, chars)
     ts = ts[ts.ms < ts.ms.quantile(.99)]
-    score = get_mistake_data(user)
+    score = get_mistake_data(cache, user)
     score.race_date = pd.to_datetime(score.race_date)
     score = score[score.mistake_score < 1]
-    wpm = get_wpm_data(user)
-    data = wpm.merge(ts, on="race_date").merge(score, on="race_date")
+    wpm = get_wpm_data(cache, user)
+    wpm.race_date = pd.to_datetime(wpm.race_date)
+    return wpm.merge(ts, on="race_date").merge(score, on="race_date")
+
+
+def plot_improvement(data, user, image_dir=IMAGE_DIR):
+    plt = pyplot()
     plt.figure(figsize=(20, 12))
     plt.subplot(2, 2, 1)
     plt.scatter(data.race_date, data.wpm)
@@ -98,16 +70,30 @@ for user in [12, 6, 19, 8]:
     plt.scatter(data.race_date, data.mistake_score)
     plt.xlabel("Race Date")
     plt.ylabel(f"Mistake score for user {user}")
-    plt.show()
-    plt.savefig(os.path.join(image_dir, f"improvement/{user}_stats.png"))
+    savefig(os.path.join(image_dir, f"improvement/{user}_stats.png"))
+    show()
+
     plt.figure(figsize=(12, 8))
-    data.ms =(data.ms - data.ms.mean())/data.ms.std()
-    data.accuracy =(data.accuracy - data.accuracy.mean())/data.accuracy.std()
-    plt.scatter(data.accuracy, data.wpm, label="normalized accuracy")
-    plt.scatter(data.ms, data.wpm, label="normalized ms")
+    ms = (data.ms - data.ms.mean()) / data.ms.std()
+    accuracy = (data.accuracy - data.accuracy.mean()) / data.accuracy.std()
+    plt.scatter(accuracy, data.wpm, label="normalized accuracy")
+    plt.scatter(ms, data.wpm, label="normalized ms")
     plt.title(f"Scatter Plot of Latency and Accuracy vs. WPM for User {user}")
-    plt.ylabel("WPM") 
+    plt.ylabel("WPM")
     plt.legend()
-    plt.show()
-    plt.savefig(os.path.join(image_dir, f"improvement/{user}_scatter.png"))
-    display(data.corr())
+    savefig(os.path.join(image_dir, f"improvement/{user}_scatter.png"))
+    show()
+
+
+def add_arguments(parser):
+    parser.add_argument("--users", type=int, nargs="+", default=USERS)
+
+
+def main(args):
+    cache = connect(args.db)
+    qwerty = cache.read_sql("select * from qwerty", tables=["qwerty"])
+    for user in args.users:
+        logger.info(f"Generating graphs for user {user}")
+        data = get_improvement_data(cache, user, qwerty.ch)
+        plot_improvement(data, user)
+        display(data.corr())
@@ -1,86 +1,24 @@
 import os
-import logging
 
-from keyboard import Keyboard
-
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-import psycopg2
 import pandas as pd
-import pandas.io.sql as psql
-from IPython.display import display
-
-logging.basicConfig()
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-conn = psycopg2.connect(dbname="typeracer", user="typescraper")
-
-base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
-image_dir = os.path.join(base_dir, "images/keyboard_diagrams")
-
-q_kb = Keyboard(os.path.join(base_dir, "configs/qwerty/qwerty_config.json"))
-d_kb = Keyboard(os.path.join(base_dir, "configs/dvorak/dvorak_config.json"))
-c_kb = Keyboard(os.path.join(base_dir, "configs/colemak/colemak_config.json"))
-
-qwerty = psql.read_sql("select * from qwerty", conn)
-dvorak = psql.read_sql("select * from dvorak", conn)
-
-
-### Keyboard Layout Heatmaps
-logger.info("Fetching count data...")
-counts = psql.read_sql(
-    """
-        select ch, count(ch) from keystrokes
-        join users on keystrokes.user_id = users.user_id
-        where ch != ''
-        group by ch
-    """,
-    conn,
-)
-logger.info("Fetched count data")
-
-q_kb.make_heatmap(
-    dict(zip(counts.ch, counts["count"])),
-    alpha=0.8,
-    interpolation='gaussian'
-)
-plt.show()
-q_kb.save(os.path.join(image_dir, "qwerty_heatmap.png"))
-logger.info("Generated QWERTY heatmap")
-
-d_kb.make_heatmap(
-    dict(zip(counts.ch, counts["count"])),
-    alpha=0.8,
-    interpolation='gaussian'
-)
-plt.show()
-d_kb.save(os.path.join(image_dir, "dvorak_heatmap.png"))
-logger.info("Generated Dvorak heatmap")
-
-c_kb.make_heatmap(
-    dict(zip(counts.ch, counts["count"])),
-    alpha=0.8,
-    interpolation='gaussian'
-)
-plt.show()
-c_kb.save(os.path.join(image_dir, "colemak_heatmap.png"))
-logger.info("Generated Colemak heatmap")
-
-
-### Keyboard Digit/Row Labels
-colors = {
+
+from analytics.common import IMAGE_DIR, connect, keyboard, legend_marker, logger, show
+
+COLORS = {
    'L1': 'm',
    'L2': 'r',
    'L3': 'y',
-   'L4': 'g', 
+   'L4': 'g',
    'R0': 'c',
    'R1': 'b',
    'R2': 'tab:orange' ,
    'R3': 'tab:purple' ,
    'R4': 'lime' ,
 }
+COL_COLORS = list(COLORS.values()) + ["tab:pink", "darkred", "lightcyan"]
+ROW_COLORS = ['c', 'g', 'y', 'r', 'm']
 
-finger = {
+FINGER = {
     0: "thumb",
     1: "index",
     2: "middle",
@@ -88,108 +26,90 @@ finger = {
     4: "pinky",
 }
 
-col_colors = list(colors.values()) + ["tab:pink", "darkred", "lightcyan"]
-
-legend_elements = []
-for key, group in qwerty.groupby(['col']):
-    if key in (0, -1, 13):
-        continue
-    i = key - 1
-    color = col_colors[i]
-    legend_elements.append(
-        Line2D(
-            [0],
-            [0],
-            color='w',
-            markerfacecolor=color,
-            alpha=0.5,
-            marker='o',
-            markersize=15,
-            label=key
-        )
+
+def get_char_counts(cache):
+    logger.info("Fetching count data...")
+    counts = cache.read_sql(
+        """
+            select ch, count(ch) as count from keystrokes
+            join users on keystrokes.user_id = users.user_id
+            where ch != ''
+            group by ch
+        """
     )
-    for ch in group.ch.tolist():
-        if ch == None or ch in q_kb.left_shift or ch in q_kb.right_shift:
-            continue
-        q_kb.fill_color(ch, color)
-q_kb.make_colormap()
-leg = q_kb.ax.legend(
-    handles=legend_elements,
-    loc='lower center',
-    ncol=5,
-    shadow=False,
-    bbox_to_anchor=(.5, -.3),
-    prop={'size': 12},
-)
-leg.get_frame().set_edgecolor('black')
-plt.show()
-q_kb.save(os.path.join(image_dir, "columns.png"))
-logger.info("Generated Digit Visualization")
-
-## Digit Labels
-legend_elements = []
-for key, group in qwerty.groupby(['hand', 'digit']):
-    i = key[0] + str(key[1])
-    h = "right" if key[0] == 'R' else "left"
-    f = h + " " + finger[key[1]]
-    color = colors[i]
-    legend_elements.append(
-        Line2D(
-            [0],
-            [0],
-            color='w',
-            markerfacecolor=color,
-            alpha=0.5,
-            marker='o',
-            markersize=15,
-            label=f
+    logger.info("Fetched count data")
+    return counts
+
+
+def plot_heatmaps(counts, image_dir=os.path.join(IMAGE_DIR, "keyboard_diagrams")):
+    """Heatmaps of how often each key is typed, on every layout."""
+    for name, title in [("qwerty", "QWERTY"), ("dvorak", "Dvorak"), ("colemak", "Colemak")]:
+        kb = keyboard(name)
+        kb.make_heatmap(
+            dict(zip(counts.ch, counts["count"])),
+            alpha=0.8,
+            interpolation='gaussian'
         )
+        kb.save(os.path.join(image_dir, f"{name}_heatmap.png"))
+        show()
+        logger.info(f"Generated {title} heatmap")
+
+
+def plot_label(kb, groups, legend_elements, bbox, path):
+    """Colours the keys of each (color, chars) group and adds a legend."""
+    for color, chars in groups:
+        for ch in chars:
+            if pd.isnull(ch) or ch in kb.left_shift or ch in kb.right_shift:
+                continue
+            kb.fill_color(ch, color)
+    kb.make_colormap()
+    leg = kb.ax.legend(
+        handles=legend_elements,
+        loc='lower center',
+        ncol=5,
+        shadow=False,
+        bbox_to_anchor=bbox,
+        prop={'size': 12},
     )
-    for ch in group.ch.tolist():
-        if ch == None or ch in q_kb.left_shift or ch in q_kb.right_shift:
-            continue
-        q_kb.fill_color(ch, color)
-q_kb.make_colormap()
-leg = q_kb.ax.legend(
-    handles=legend_elements,
-    loc='lower center',
-    ncol=5,
-    shadow=False,
-    bbox_to_anchor=(.5, -.2),
-    prop={'size': 12},
-)
-leg.get_frame().set_edgecolor('black')
-plt.show()
-q_kb.save(os.path.join(image_dir, "digits.png"))
-logger.info("Generated Digit Visualization")
-
-
-## Row Labels
-row_colors = ['c', 'g', 'y', 'r', 'm']
-for row, group in qwerty.groupby("row"):
-    i = row + 2
-    color = row_colors[i]
-    for ch in group.ch.tolist():
-        if ch == None or ch in q_kb.left_shift or ch in q_kb.right_shift:
+    leg.get_frame().set_edgecolor('black')
+    kb.save(path)
+    show()
+
+
+def plot_labels(qwerty, image_dir=os.path.join(IMAGE_DIR, "keyboard_diagrams")):
+    """qwerty keys coloured by column, by hand and digit, and by row."""
+    kb = keyboard("qwerty")
+
+    groups, legend_elements = [], []
+    for key, group in qwerty.groupby('col'):
+        if key in (0, -1, 13):
             continue
-        q_kb.fill_color(ch, color)
-q_kb.make_colormap()
-legend_elements = [
-    Line2D([0], [0], color='w', markerfacecolor='m', alpha=0.5, marker='o', markersize=15, label='2'),
-    Line2D([0], [0], color='w', markerfacecolor='r', alpha=0.5, marker='o', markersize=15, label='1'),
-    Line2D([0], [0], color='w', markerfacecolor='y', alpha=0.5, marker='o', markersize=15, label='0'),
-    Line2D([0], [0], color='w', markerfacecolor='g', alpha=0.5, marker='o', markersize=15, label='-1'),
-    Line2D([0], [0], color='w', markerfacecolor='c', alpha=0.5, marker='o', markersize=15, label='-2'),
-]
-leg = q_kb.ax.legend(
-    handles=legend_elements,
-    loc='lower center',
-    ncol=5,
-    shadow=False,
-    bbox_to_anchor=(.5, -.12),
-    prop={'size': 12},
-)
-leg.get_frame().set_edgecolor('black')
-plt.show()
-q_kb.save(os.path.join(image_dir, "rows.png"))
-logger.info("Generated Row Visualization")
+        color = COL_COLORS[key - 1]
+        legend_elements.append(legend_marker(color, key))
+        groups.append((color, group.ch.tolist()))
+    plot_label(kb, groups, legend_elements, (.5, -.3), os.path.join(image_dir, "columns.png"))
+    logger.info("Generated Digit Visualization")
+
+    groups, legend_elements = [], []
+    for key, group in qwerty.groupby(['hand', 'digit']):
+        color = COLORS[key[0] + str(key[1])]
+        h = "right" if key[0] == 'R' else "left"
+        legend_elements.append(legend_marker(color, h + " " + FINGER[key[1]]))
+        groups.append((color, group.ch.tolist()))
+    plot_label(kb, groups, legend_elements, (.5, -.2), os.path.join(image_dir, "digits.png"))
+    logger.info("Generated Digit Visualization")
+
+    groups = [(ROW_COLORS[row + 2], group.ch.tolist()) for row, group in qwerty.groupby("row")]
+    legend_elements = [legend_marker(ROW_COLORS[row + 2], str(row)) for row in [2, 1, 0, -1, -2]]
+    plot_label(kb, groups, legend_elements, (.5, -.12), os.path.join(image_dir, "rows.png"))
+    logger.info("Generated Row Visualization")
+
+
+def add_arguments(parser):
+    pass
+
+
+def main(args):
+    cache = connect(args.db)
+    plot_heatmaps(get_char_counts(cache))
+    plot_labels(cache.read_sql("select * from qwerty", tables=["qwerty"]))
@@ -1,179 +1,162 @@
 import os
-import logging
 
-from keyboard import Keyboard
-
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
-import psycopg2
 import pandas as pd
-import pandas.io.sql as psql
-from IPython.display import display
 
-logging.basicConfig()
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-conn = psycopg2.connect(dbname="typeracer", user="typescraper")
+from analytics.common import BASE_DIR, IMAGE_DIR, connect, display, keyboard, logger, pyplot, savefig, show
+from layout import Layout
+from utils.aggregates import StreamingStats, weighted_stats
 
-base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
-image_dir = os.path.join(base_dir, "images")
+SKEW_USERS = [5, 6, 8, 12, 19]
 
-q_kb = Keyboard(os.path.join(base_dir, "configs/qwerty/qwerty_config.json"))
+FINGER = {
+    0: "thumb",
+    1: "index",
+    2: "middle",
+    3: "ring",
+    4: "pinky",
+}
 
-qwerty = psql.read_sql("select * from qwerty", conn)
 
-def get_char_transitions(user):
+def get_char_transitions(cache, user):
     query = """
-        select ch_prev, ch, ms, race_date
+        select ch_prev, ch, ms
         from keystrokes
-        where forward 
+        where forward
               and forward_prev
               and user_id = %s
               and seq_index > 1
     """
-    return psql.read_sql(query, conn, params=[user])
+    return cache.storage.read_chunks(query, params=[user], dtypes={"ms": "int32"})
 
 
-def get_transition_data(user):
-    transitions = get_char_transitions(user)
-    data = transitions.merge(
-        qwerty, left_on="ch_prev", right_on="ch", suffixes=["_next", ""]
-    )
-    del data["ch"]
-    data = data.merge(
-        qwerty, left_on="ch_next", right_on="ch", suffixes=["_prev", "_next"]
+def get_transition_data(cache, qwerty, user):
+    """
+    How many times (n) the user typed each bigram of qwerty keys at each
+    latency (ms), below their 99th percentile, with the features of both
+    keys. Stands in for the raw transitions: every statistic below weighs
+    a row by its n.
+    """
+    counts = cache.cached("transition_counts", [user], lambda: read_transition_counts(cache, qwerty, user), user=user)
+    return qwerty.annotate(counts, "ch_prev", "ch_next", suffixes=["_prev", "_next"])
+
+
+def read_transition_counts(cache, qwerty, user):
+    stats = StreamingStats(["ch_prev", "ch_next"], "ms")
+    for transitions in get_char_transitions(cache, user):
+        transitions = transitions.rename(columns={"ch": "ch_next"})
+        _, known = qwerty.bigram_features(transitions.ch_prev, transitions.ch_next)
+        stats.update(transitions[known])
+    counts = stats.frame()
+    return counts[counts.ms < stats.quantile(0.99)].reset_index(drop=True)
+
+
+def latency(data, keys):
+    """Mean, std and count of ms per group of keys, as groupby().ms.agg() would give."""
+    return weighted_stats(data, keys, "ms").set_index(keys)[["mean", "std", "count"]]
+
+
+def plot_shift_latency(data, user, image_dir=IMAGE_DIR):
+    """Latency after a shifted key against after an unshifted one."""
+    plt = pyplot()
+    shifted = data[data.shifted_prev & ~data.shifted_next]
+    notshifted = data[~data.shifted_prev & ~data.shifted_next]
+    plt.figure()
+    plt.hist(notshifted.ms, weights=notshifted.n, density=True, alpha=0.7, label="no Shift")
+    plt.hist(shifted.ms, weights=shifted.n, density=True, alpha=0.7, label="Shift")
+    plt.title("Latency Density Histogram")
+    plt.legend()
+    savefig(os.path.join(image_dir, f"latency_histograms/shifted_latency_histogram_user_{user}.png"))
+    show()
+    display(latency(data, ["shifted_prev", "shifted_next"]))
+
+
+def plot_key_latency(data, user, shifted, image_dir=IMAGE_DIR):
+    """Heatmap of the mean latency into each (shifted or unshifted) key."""
+    kb = keyboard("qwerty")
+    keys = data[data.shifted_next] if shifted else data[~data.shifted_next]
+    counts = keys.groupby("ch_next").n.sum()
+    to_keep = counts[counts > (20 if shifted else 100)].index.tolist()
+    keys = keys[keys.ch_next.isin(to_keep)]
+    kb.set_heatmap(latency(keys, ["ch_next"])["mean"].to_dict())
+    if shifted:
+        kb.scale("lshift", 0.)
+        kb.scale("rshift", 0.)
+    kb.show_heatmap(cmap='inferno')
+    name = "shifted" if shifted else "noshifted"
+    kb.save(os.path.join(image_dir, f"keyboard_diagrams/{name}_heatmap_user_{user}.png"))
+    show()
+
+    display(latency(keys, ["row_next"]))
+    keys = keys.assign(
+        hand_next=keys.hand_next.map({"L": "left", "R": "right"}),
+        digit_next=keys.digit_next.map(FINGER),
     )
-    del data["ch"]
-    return data[data.ms < data.ms.quantile(0.99)]
+    display(latency(keys, ["hand_next", "digit_next"]))
 
 
-dat_5 = get_transition_data(5)
+def transition_skew(cache, qwerty, users, image_dir=IMAGE_DIR):
+    """
+    Skewness of each user's mean latency per unshifted transition, below
+    their 99th percentile of latency.
+    """
+    plt = pyplot()
+    skw = {}
+    for user in users:
+        speeds = get_transition_speeds(get_transition_data(cache, qwerty, user))
+        skw[user] = speeds["mean"].skew()
+        plt.figure()
+        plt.hist(speeds["mean"])
+        plt.xlabel("Latency (ms)")
+        plt.title(f"Transition Speeds for User {user}")
+        savefig(os.path.join(image_dir, f"latency_histograms/transition_histogram_{user}.png"))
+        show()
+    return pd.DataFrame({"user_id": list(skw), "skewness": list(skw.values())})
+
+
+def get_transition_speeds(data):
+    """Latency of every unshifted transition between two keys typed over 100 times."""
+    transitions = data[~data.shifted_next & ~data.shifted_prev]
+    speeds = latency(transitions, ["ch_prev", "ch_next"]).reset_index()
+    speeds = speeds[speeds.ch_prev != speeds.ch_next]
+    return speeds[speeds["count"] > 100]
 
-### Histogram
-shifted = dat_5[dat_5.shifted_prev & ~dat_5.shifted_next]
-notshifted = dat_5[~dat_5.shifted_prev & ~dat_5.shifted_next]
-plt.hist(notshifted.ms, density=True, alpha=0.7, label="no Shift")
-plt.hist(shifted.ms, density=True, alpha=0.7, label="Shift")
-plt.title("Latency Density Histogram")
-plt.legend()
-plt.show()
-plt.savefig(os.path.join(image_dir, "latency_histograms/shifted_latency_histogram_user_5.png"))
 
-display(dat_5.groupby(["shifted_prev", "shifted_next"]).ms.agg(["mean", "std", "count"]))
+def get_slow_transitions(data):
+    speeds = get_transition_speeds(data)
+    return speeds[speeds["mean"] > 100]
 
 
-### Keyboard Visual
+def render_transitions(speeds, image_dir=IMAGE_DIR):
+    """Draws every key's slow transitions, into and out of it."""
+    from utils.render import Renderer
 
-finger = {
-    0: "thumb",
-    1: "index",
-    2: "middle",
-    3: "ring",
-    4: "pinky",
-}
+    config_file = os.path.join(BASE_DIR, "configs/qwerty/qwerty_config.json")
+    jobs = []
+    for k, group in speeds.groupby("ch_prev"):
+        config = k + "_" + "".join(sorted(group.ch_next.tolist()))
+        colors = {k: 'tab:blue', **{ch: 'tab:orange' for ch in group.ch_next}}
+        jobs.append(dict(config=config_file, colors=colors, output=os.path.join(image_dir, f"transition_vis/vis_{config}.png")))
+
+    for k, group in speeds.groupby("ch_next"):
+        config = "".join(sorted(group.ch_prev.tolist())) + "_" + k
+        colors = {k: 'tab:orange', **{ch: 'tab:blue' for ch in group.ch_prev}}
+        jobs.append(dict(config=config_file, colors=colors, output=os.path.join(image_dir, f"vis_{config}.png")))
+
+    rendered = Renderer().run(jobs)
+    logger.info(f"Rendered {len(rendered)} of {len(jobs)} transition visuals")
+
+
+def group_transitions(data, speeds, feats):
+    """Slow transitions grouped by the feats of both keys."""
+    data = data.merge(speeds[["ch_prev", "ch_next"]])
+    data.digit_prev = data.digit_prev.map(FINGER)
+    data.digit_next = data.digit_next.map(FINGER)
+    valid_transitions = set(zip(speeds.ch_prev.tolist(), speeds.ch_next.tolist()))
 
-shifted = dat_5[dat_5.shifted_next]
-counts = shifted.groupby("ch_next").ms.count().reset_index()
-to_keep = counts[counts.ms > 20].ch_next.tolist()
-shifted = shifted[shifted.ch_next.isin(to_keep)]
-q_kb.make_heatmap(
-    shifted.groupby("ch_next").ms.mean().to_dict(), cmap='inferno'
-)
-q_kb.scale("lshift", 0.)
-q_kb.scale("rshift", 0.)
-q_kb.show_heatmap(cmap='inferno')
-plt.show()
-q_kb.save(os.path.join(image_dir, "keyboard_diagrams/shifted_heatmap_user_5.png"))
-
-display(shifted.groupby("row_next").ms.agg(["mean", "std", "count"]))
-shifted.hand_next = shifted.hand_next.map({"L": "left", "R": "right"})
-shifted.digit_next = shifted.digit_next.map(finger)
-display(shifted.groupby(["hand_next", "digit_next"]).ms.agg(["mean", "std", "count"]))
-
-notshifted = dat_5[~dat_5.shifted_next]
-counts = notshifted.groupby("ch_next").ms.count().reset_index()
-to_keep = counts[counts.ms > 100].ch_next.tolist()
-notshifted = notshifted[notshifted.ch_next.isin(to_keep)]
-q_kb.make_heatmap(
-    notshifted.groupby("ch_next").ms.mean().to_dict(), cmap='inferno'
-)
-plt.show()
-q_kb.save(os.path.join(image_dir, "keyboard_diagrams/noshifted_heatmap_user_5.png"))
-display(notshifted.groupby("row_next").ms.agg(["mean", "std", "count"]))
-notshifted.hand_next = notshifted.hand_next.map({"L": "left", "R": "right"})
-notshifted.digit_next = notshifted.digit_next.map(finger)
-display(notshifted.groupby(["hand_next", "digit_next"]).ms.agg(["mean", "std", "count"]))
-
-
-skw = {}
-for user in [5, 6, 8, 12, 19]:
-    dat = get_transition_data(user)
-    transitions = dat[~dat.shifted_next & ~dat.shifted_prev]
-    speeds = (
-        transitions
-        .groupby(["ch_prev", "ch_next"]).ms
-        .agg(["mean", "std", "count"])
-        .reset_index()
-    )
-    speeds = speeds[speeds.ch_prev != speeds.ch_next]
-    speeds = speeds[speeds["count"] > 100]
-    skw[user] = speeds["mean"].skew()
-    plt.hist(speeds["mean"])
-    plt.xlabel("Latency (ms)")
-    plt.title(f"Transition Speeds for User {user}")
-    plt.show()
-    plt.savefig(os.path.join(image_dir, f"latency_histograms/transition_histogram_{user}.png"))
-
-skw_df = pd.DataFrame.from_dict(skw, orient='index').reset_index()
-skw_df["user_id"] = skw_df["index"]
-skw_df["skewness"] = skw_df[0]
-skw_df = skw_df[skw_df.user_id.isin([5, 6, 12, 19, 8])]
-display(skw_df[["user_id", "skewness"]].reset_index(drop=True))
-
-
-transitions = dat_5[~dat_5.shifted_next & ~dat_5.shifted_prev]
-speeds = transitions.groupby(["ch_prev", "ch_next"]).ms.agg(["mean", "std", "count"]).reset_index()
-speeds = speeds[speeds.ch_prev != speeds.ch_next]
-speeds = speeds[speeds["count"] > 100]
-speeds = speeds[speeds["mean"] > 100]
-display(speeds.sort_values(by="mean", ascending=False).reset_index(drop=True))
-
-generated = set()
-
-for k, group in speeds.groupby("ch_prev"):
-    config = k + "_" + "".join(sorted(group.ch_next.tolist()))
-    if config in generated:
-        continue
-    q_kb.fill_color(k, 'tab:blue')
-    for ch in group.ch_next:
-        q_kb.fill_color(ch, 'tab:orange')
-    q_kb.make_colormap()
-    logger.info(config)
-    plt.show()
-    q_kb.save(os.path.join(image_dir, f"transition_vis/vis_{config}.png"))
-    
-for k, group in speeds.groupby("ch_next"):
-    config = "".join(sorted(group.ch_prev.tolist())) + "_" + k
-    if config in generated:
-        continue
-    q_kb.fill_color(k, 'tab:orange')
-    for ch in group.ch_prev:
-        q_kb.fill_color(ch, 'tab:blue')
-    q_kb.make_colormap()
-    logger.info(config)
-    plt.show()
-    q_kb.save(os.path.join(image_dir, f"vis_{config}.png"))
-
-dat_5 = dat_5.merge(speeds[["ch_prev", "ch_next"]])
-dat_5.digit_prev = dat_5.digit_prev.map(finger)
-dat_5.digit_next = dat_5.digit_next.map(finger)
-valid_transitions = list(zip(speeds.ch_prev.tolist(), speeds.ch_next.tolist()))
-
-for feats in (["hand", "digit", "row"], ["hand", "digit"]):
     keys = [f"{feat}_{pos}" for feat in feats for pos in ["prev", "next"]]
-    unique_chars_next = dat_5.groupby(keys)["ch_next"].unique().reset_index()
-    unique_chars_prev = dat_5.groupby(keys)["ch_prev"].unique().reset_index()
-    group = dat_5.groupby(keys)["ms"].agg(["mean", "std", "count"]).reset_index()
+    unique_chars_next = data.groupby(keys)["ch_next"].unique().reset_index()
+    unique_chars_prev = data.groupby(keys)["ch_prev"].unique().reset_index()
+    group = latency(data, keys).reset_index()
     group = group.sort_values(by="mean", ascending=False)
     group = group.merge(unique_chars_prev, on=keys).merge(unique_chars_next, on=keys)
     if "row" in feats:
@@ -185,4 +168,26 @@ for feats in (["hand", "digit", "row"], ["hand", "digit"]):
     for p, n in zip(group.ch_prev.tolist(), group.ch_next.tolist()):
         transitions.append(" | ".join([f"{pr} -> {nx}" for pr in p for nx in n if (pr, nx) in valid_transitions]))
     group["transitions"] = transitions
-    display(group[cols].reset_index(drop=True))
+    return group[cols].reset_index(drop=True)
+
+
+def add_arguments(parser):
+    parser.add_argument("--user", type=int, default=5, help="user whose transitions are analysed")
+    parser.add_argument("--skew-users", type=int, nargs="+", default=SKEW_USERS)
+
+
+def main(args):
+    cache = connect(args.db)
+    qwerty = Layout.from_db(cache, "qwerty")
+    data = get_transition_data(cache, qwerty, args.user)
+
+    plot_shift_latency(data, args.user)
+    plot_key_latency(data, args.user, shifted=True)
+    plot_key_latency(data, args.user, shifted=False)
+    display(transition_skew(cache, qwerty, args.skew_users))
+
+    speeds = get_slow_transitions(data)
+    display(speeds.sort_values(by="mean", ascending=False).reset_index(drop=True))
+    render_transitions(speeds)
+    for feats in (["hand", "digit", "row"], ["hand", "digit"]):
+        display(group_transitions(data, speeds, feats))
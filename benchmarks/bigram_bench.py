@@ -0,0 +1,69 @@
+import os
+import sys
+import argparse
+import timeit
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.keystrokes import RACE_KEY, ACTION_COLUMNS, KEYSTROKE_COLUMNS, race_keystrokes, to_bigrams
+from utils.typinglog import parse_log
+from typinglog_bench import TEXT, synthetic_log
+
+
+def legacy_bigrams(text_id, user_id, race_date, race_id, actions):
+    keystrokes = [[text_id, user_id, race_date, race_id, "", 0, True, -1]]
+    for ch, ch_idx, typed, ms in actions:
+        keystrokes.append([text_id, user_id, race_date, race_id, ch, ms, typed, ch_idx])
+    action_df = pd.DataFrame(
+        keystrokes,
+        columns=['text_id', 'user_id', 'race_date', 'race_id', 'ch', 'ms', 'forward', 'ch_index'],
+    ).reset_index()
+    action_df = action_df.rename(columns={"index": "seq_index"})
+    action_df = action_df.merge(action_df, on=RACE_KEY, suffixes=["", "_prev"])
+    action_df = action_df[action_df.seq_index - action_df.seq_index_prev == 1]
+    return action_df[KEYSTROKE_COLUMNS]
+
+
+def action_frame(races):
+    rows = []
+    for text_id, user_id, race_date, race_id, actions in races:
+        rows.append((text_id, user_id, race_date, race_id, 0, "", 0, True, -1))
+        for seq_index, (ch, ch_idx, typed, ms) in enumerate(actions, 1):
+            rows.append((text_id, user_id, race_date, race_id, seq_index, ch, ms, typed, ch_idx))
+    return pd.DataFrame(rows, columns=ACTION_COLUMNS)
+
+
+def same(a, b):
+    a = a.reset_index(drop=True)
+    b = b.reset_index(drop=True)
+    return a.astype(str).equals(b.astype(str))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--number", type=int, default=10)
+    args = arg_parser.parse_args()
+    date = datetime(2020, 4, 1)
+    races = [
+        (1, 1, date, race_id, list(parse_log(synthetic_log(TEXT, repeat, seed=race_id))))
+        for race_id, repeat in enumerate((1, 4, 16), 1)
+    ]
+    bulk = to_bigrams(action_frame(races))
+    for race in races:
+        expected = legacy_bigrams(*race)
+        assert same(expected, race_keystrokes(*race)), "race_keystrokes disagrees"
+        assert same(expected, bulk[bulk.race_id == race[3]]), "to_bigrams disagrees"
+        keystrokes = len(race[4])
+        legacy = timeit.timeit(lambda: legacy_bigrams(*race), number=args.number)
+        linear = timeit.timeit(lambda: race_keystrokes(*race), number=args.number)
+        print(
+            f"race {race[3]}: {keystrokes} keystrokes, "
+            f"self-merge {1000 * legacy / args.number:.3f} ms, "
+            f"linear {1000 * linear / args.number:.3f} ms"
+        )
+    frame = action_frame(races * 100)
+    shifted = timeit.timeit(lambda: to_bigrams(frame), number=args.number)
+    print(f"to_bigrams: {len(frame)} stacked keystrokes in {1000 * shifted / args.number:.3f} ms")
@@ -0,0 +1,112 @@
+import os
+import sys
+import argparse
+import time
+import zlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.extract import FastExtractor, SoupExtractor
+from typinglog_bench import TEXT, synthetic_log
+
+NAVIGATION = "".join(
+    f'<li class="nav"><a href="/pit/section?id={i}"><span>Section {i}</span></a></li>\n'
+    for i in range(60)
+)
+
+RACE_PAGE = """<!DOCTYPE html>
+<html><head><title>Typing Race Results</title>
+<script type="text/javascript" src="/public/app.js"></script>
+<script type="text/javascript">
+  var typingLog = "{log},";
+  var raceSpeed = 87;
+</script></head>
+<body><ul class="menu">{nav}</ul>
+<div class="themeContent">
+<table class="raceDetails">
+<tr>
+<td>Racer</td>
+<td><a href="/pit/profile?user=bob">bob</a></td>
+</tr>
+<tr>
+<td>Race Number</td>
+<td>{race_id}</td>
+</tr>
+<tr>
+<td>Date</td>
+<td>Sat, 4 Apr 2020 13:05:02 </td>
+</tr>
+</table>
+<div class="fullTextStr">{text}</div>
+<a href="/pit/text_info?id=3550123">{text_id}</a>
+</div><ul class="footer">{nav}</ul></body></html>"""
+
+HISTORY_ROW = """<tr>
+<td><a href="/pit/result?id=|tr:bob|{race_id}">{race_id}</a></td>
+<td>{wpm} WPM</td>
+<td>97.0%</td>
+<td>1/3</td>
+<td>Sat, 4 Apr 2020</td>
+</tr>
+"""
+
+HISTORY_PAGE = """<html><body><ul class="menu">{nav}</ul>
+<table class="scoresTable">
+<tr><th>Race #</th><th>Speed</th><th>Accuracy</th><th>Place</th><th>Date</th></tr>
+{rows}</table></body></html>"""
+
+
+def synthetic_pages(n):
+    races = [
+        RACE_PAGE.format(
+            log=synthetic_log(TEXT, 2, seed=i),
+            nav=NAVIGATION,
+            race_id=i,
+            text=TEXT.replace("&", "&amp;"),
+            text_id=3550123,
+        )
+        for i in range(n)
+    ]
+    rows = "".join(HISTORY_ROW.format(race_id=i, wpm=60 + i % 40) for i in range(100))
+    history = [HISTORY_PAGE.format(nav=NAVIGATION, rows=rows)] * n
+    return races, history
+
+
+def cached_pages(path):
+    races, history = [], []
+    for root, _, files in os.walk(path):
+        for name in files:
+            with open(os.path.join(root, name), "rb") as f:
+                html = zlib.decompress(f.read()).decode("utf-8")
+            if "typingLog" in html:
+                races.append(html)
+            elif "scoresTable" in html:
+                history.append(html)
+    return races, history
+
+
+def rate(method, pages):
+    start = time.perf_counter()
+    results = [method(page) for page in pages]
+    return results, len(pages) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--cache-dir", help="benchmark pages from a typescraper page cache")
+    arg_parser.add_argument("--pages", type=int, default=200)
+    args = arg_parser.parse_args()
+    races, history = cached_pages(args.cache_dir) if args.cache_dir else synthetic_pages(args.pages)
+    fast, soup = FastExtractor(), SoupExtractor()
+    for kind, pages in (("race", races), ("history", history)):
+        if not pages:
+            continue
+        fast_results, fast_rate = rate(getattr(fast, kind), pages)
+        soup_results, soup_rate = rate(getattr(soup, kind), pages)
+        for a, b in zip(fast_results, soup_results):
+            same = a == b if kind == "race" else a.astype(str).equals(b.astype(str))
+            assert same, f"{kind} extractors disagree"
+        print(
+            f"{kind}: {len(pages)} pages, "
+            f"fast {fast_rate:.0f} pages/s, soup {soup_rate:.0f} pages/s per core"
+        )
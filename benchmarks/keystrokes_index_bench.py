@@ -0,0 +1,133 @@
+import os
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+
+import psycopg2
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# The analytics queries, for one user (and about 1% of the history for the
+# date range).
+QUERIES = {
+    "transitions": """
+        select ch_prev, ch, ms, race_date
+        from keystrokes
+        where forward
+              and forward_prev
+              and user_id = %(user)s
+              and seq_index > 1
+    """,
+    "no_mistakes": """
+        select ch_prev, ch, ms from (
+            select ch_prev, ch, ms, forward, forward_prev, seq_index,
+                   count(ms) over w as c, max(seq_index) over w as m_i
+            from keystrokes
+            where user_id = %(user)s
+            window w as (partition by race_id, ch_index)
+        ) k
+        where forward and forward_prev and mod(c, 2) = 1 and seq_index = m_i
+    """,
+    "mistakes_by_date": """
+        select date(race_date) as race_date,
+               cast(sum(ms * (1 - forward::int)) as float) / sum(ms) as mistake_score
+        from keystrokes
+        where user_id = %(user)s
+        group by race_date
+    """,
+    "date_range": """
+        select date(race_date), avg(ms)
+        from keystrokes
+        where race_date >= %(start)s and race_date < %(stop)s
+        group by 1
+    """,
+}
+
+# Races are laid out in time order, round-robin over users, like a cohort
+# scraped over time; every race is race_length keystrokes.
+GENERATE = """
+    insert into keystrokes
+    select 1 + race %% 1000,
+           1 + race %% %(users)s,
+           timestamp '2018-01-01' + race * interval '1 minute',
+           1 + race / %(users)s,
+           case when seq = 1 then null else chr(97 + ((i - 1) * 7 %% 26)::int) end,
+           chr(97 + (i * 7 %% 26)::int),
+           50 + (i * 2654435761) %% 400,
+           seq = 1 or (i - 1) %% 17 <> 0,
+           i %% 17 <> 0,
+           seq - 1,
+           seq
+    from (
+        select i, i / %(race_length)s as race, 1 + i %% %(race_length)s as seq
+        from generate_series(%(start)s::bigint, %(stop)s::bigint - 1) as i
+    ) g
+"""
+
+
+def load(conn, rows, users, race_length, chunk=5000000):
+    cur = conn.cursor()
+    cur.execute("insert into users(user_id, username) select u, 'bench' || u from generate_series(1, %s) u", [users])
+    cur.execute("insert into texts select t, 'text ' || t from generate_series(1, 1000) t")
+    for start in range(0, rows, chunk):
+        stop = min(rows, start + chunk)
+        cur.execute(GENERATE, dict(users=users, race_length=race_length, start=start, stop=stop))
+        conn.commit()
+        print(f"Loaded {stop} rows")
+
+
+def run(conn, params, repeat):
+    """
+    Returns the best server-side execution time of each query in ms (so the
+    comparison is not swamped by shipping results to the client) and the
+    number of buffers it touched, which is what turns into disk reads once
+    the table no longer fits in memory.
+    """
+    cur = conn.cursor()
+    timings = {}
+    for name, query in QUERIES.items():
+        best = None
+        for _ in range(repeat):
+            cur.execute("explain (analyze, buffers, timing off, format json) " + query, params)
+            result = cur.fetchone()[0][0]
+            elapsed = result["Execution Time"]
+            if best is None or elapsed < best[0]:
+                plan = result["Plan"]
+                best = elapsed, plan["Shared Hit Blocks"] + plan["Shared Read Blocks"]
+        timings[name] = best
+    return timings
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Times the analytics queries before and after the keystrokes migrations."
+    )
+    arg_parser.add_argument("dbname", help="an empty scratch database, e.g. createdb typeracer_bench")
+    arg_parser.add_argument("--rows", type=int, default=100000000)
+    arg_parser.add_argument("--users", type=int, default=100)
+    arg_parser.add_argument("--race-length", type=int, default=300)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    subprocess.run(
+        ["psql", "-q", "-o", os.devnull, "-v", "ON_ERROR_STOP=1", args.dbname, "-f", "configs/postgres/typeracerdb.sql"],
+        cwd=BASE_DIR, check=True,
+    )
+    conn = psycopg2.connect(dbname=args.dbname)
+    load(conn, args.rows, args.users, args.race_length)
+    conn.autocommit = True
+    conn.cursor().execute("vacuum analyze keystrokes")
+    races = args.rows // args.race_length
+    start = datetime(2018, 1, 1) + timedelta(minutes=races // 2)
+    params = dict(user=1 + args.users // 2, start=start, stop=start + timedelta(minutes=max(60, races // 100)))
+
+    before = run(conn, params, args.repeat)
+    subprocess.run(["sh", "migrate.sh", args.dbname], cwd=BASE_DIR, check=True)
+    conn.cursor().execute("vacuum analyze keystrokes")
+    after = run(conn, params, args.repeat)
+
+    print(f"{args.rows} rows, {args.users} users")
+    for name in QUERIES:
+        (ms_before, pages_before), (ms_after, pages_after) = before[name], after[name]
+        print(f"{name:>18}: {ms_before:10.1f}ms -> {ms_after:10.1f}ms ({ms_before / ms_after:.1f}x), "
+              f"{pages_before} -> {pages_after} buffers")
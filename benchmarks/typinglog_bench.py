@@ -0,0 +1,106 @@
+import os
+import sys
+import argparse
+import random
+import re
+import timeit
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.typinglog import parse_log
+
+
+TEXT = (
+    "The quick brown fox jumps over the lazy dog, while the bored cat | "
+    "watches from a sunny windowsill and wonders why anyone would bother."
+)
+
+
+def legacy_parse_token(token):
+    if len(token) == 0:
+        return []
+    delim = re.search(r'[^\d]', token)
+    if delim is None:
+        return []
+    i = delim.start()
+    ch_idx = int(token[:i])
+    end = i + 1
+    if end == len(token):
+        return []
+    end = end + 1 if token[end] == '\\' else end
+    ch = token[end]
+    if token[i] == '+' or token[i] == '$':
+        typed = True
+    elif token[i] == '-':
+        typed = False
+    else:
+        return legacy_parse_token(token[end + 1:])
+    return [[ch, ch_idx, typed]] + legacy_parse_token(token[end + 1:])
+
+
+def legacy_parse_log(data):
+    data = re.split(r'(?<!\d[\+\-\$])\|', data)[-1]
+    queue = deque(re.split(r'(?<!\d[\+\-\$]),', data))
+    keystrokes = []
+    while queue:
+        word_idx = int(queue.popleft())
+        length = int(queue.popleft())
+        for i in range(length):
+            ms = int(queue.popleft())
+            stats = legacy_parse_token(queue.popleft())
+            ms //= len(stats)
+            for ch, ch_idx, typed in stats:
+                keystrokes.append((ch, word_idx + ch_idx, typed, ms))
+    return keystrokes
+
+
+def synthetic_log(text, repeat, error_rate=0.05, seed=0):
+    rng = random.Random(seed)
+    text = " ".join([text] * repeat)
+    fields = []
+    word_idx = 0
+    for word in re.findall(r'\S+\s?', text):
+        tokens = []
+        for i, ch in enumerate(word):
+            if rng.random() < error_rate:
+                tokens.append((rng.randint(50, 400), f"{i}+x"))
+                tokens.append((rng.randint(50, 400), f"{i}-x"))
+            if rng.random() < error_rate:
+                tokens.append((rng.randint(50, 400), f"{i}+{ch}{i + 1}-{ch}{i}-{ch}"))
+            tokens.append((rng.randint(50, 400), f"{i}+{ch}"))
+        fields += [str(word_idx), str(len(tokens))]
+        for ms, token in tokens:
+            fields += [str(ms), token]
+        word_idx += len(word)
+    return "0,0,|" + ",".join(fields)
+
+
+def load_corpus(path):
+    logs = []
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name)) as f:
+            logs.append(f.read().strip())
+    return logs
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--corpus", help="directory of raw typingLog strings, one per file")
+    arg_parser.add_argument("--number", type=int, default=20)
+    args = arg_parser.parse_args()
+    if args.corpus:
+        logs = load_corpus(args.corpus)
+    else:
+        logs = [synthetic_log(TEXT, repeat) for repeat in (1, 4, 16)]
+    for log in logs:
+        assert legacy_parse_log(log) == list(parse_log(log)), "parsers disagree"
+    print(f"{len(logs)} logs parsed identically")
+    for i, log in enumerate(logs):
+        legacy = timeit.timeit(lambda: legacy_parse_log(log), number=args.number)
+        stream = timeit.timeit(lambda: list(parse_log(log)), number=args.number)
+        print(
+            f"log {i}: {len(log)} chars, "
+            f"legacy {1000 * legacy / args.number:.3f} ms/race, "
+            f"streaming {1000 * stream / args.number:.3f} ms/race"
+        )
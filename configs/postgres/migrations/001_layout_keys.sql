@@ -0,0 +1,20 @@
+--
+-- Unique keys for the layout tables, so KeyboardLoader can upsert into them.
+-- Rows duplicated by loading a layout twice are removed first.
+--
+
+DELETE FROM public.qwerty a USING public.qwerty b
+    WHERE a.ctid < b.ctid AND a."row" = b."row" AND a.col = b.col AND a.shifted = b.shifted;
+DELETE FROM public.dvorak a USING public.dvorak b
+    WHERE a.ctid < b.ctid AND a."row" = b."row" AND a.col = b.col AND a.shifted = b.shifted;
+DELETE FROM public.colemak a USING public.colemak b
+    WHERE a.ctid < b.ctid AND a."row" = b."row" AND a.col = b.col AND a.shifted = b.shifted;
+
+ALTER TABLE ONLY public.qwerty
+    ADD CONSTRAINT qwerty_key UNIQUE ("row", col, shifted);
+
+ALTER TABLE ONLY public.dvorak
+    ADD CONSTRAINT dvorak_key UNIQUE ("row", col, shifted);
+
+ALTER TABLE ONLY public.colemak
+    ADD CONSTRAINT colemak_key UNIQUE ("row", col, shifted);
@@ -0,0 +1,65 @@
+--
+-- Hash-partitions keystrokes by user_id, so per-user analytics only touch
+-- one partition, and adds indexes for the analytics queries:
+--   * a partial covering index for forward-only transitions
+--     (select ch_prev, ch, ms, race_date ... where forward and forward_prev
+--     and seq_index > 1), answered with index-only scans;
+--   * a covering index on (user_id, race_id, ch_index) for the
+--     per-character mistake counts grouped by race_id, ch_index;
+--   * a BRIN index on race_date, which follows insertion order.
+--
+
+ALTER TABLE public.keystrokes RENAME TO keystrokes_unpartitioned;
+ALTER TABLE public.keystrokes_unpartitioned RENAME CONSTRAINT keystrokes_pkey TO keystrokes_unpartitioned_pkey;
+ALTER TABLE public.keystrokes_unpartitioned RENAME CONSTRAINT keystrokes_text_id_fkey TO keystrokes_unpartitioned_text_id_fkey;
+ALTER TABLE public.keystrokes_unpartitioned RENAME CONSTRAINT keystrokes_user_id_fkey TO keystrokes_unpartitioned_user_id_fkey;
+
+CREATE TABLE public.keystrokes (
+    text_id integer NOT NULL,
+    user_id integer NOT NULL,
+    race_date timestamp without time zone,
+    race_id integer NOT NULL,
+    ch_prev character(1),
+    ch character(1),
+    ms integer,
+    forward_prev boolean,
+    forward boolean,
+    ch_index integer,
+    seq_index integer NOT NULL
+) PARTITION BY HASH (user_id);
+
+DO $$
+BEGIN
+    FOR i IN 0..15 LOOP
+        EXECUTE format(
+            'CREATE TABLE public.keystrokes_p%s PARTITION OF public.keystrokes FOR VALUES WITH (MODULUS 16, REMAINDER %s)',
+            i, i
+        );
+    END LOOP;
+END
+$$;
+
+INSERT INTO public.keystrokes SELECT * FROM public.keystrokes_unpartitioned;
+DROP TABLE public.keystrokes_unpartitioned;
+
+ALTER TABLE public.keystrokes
+    ADD CONSTRAINT keystrokes_pkey PRIMARY KEY (user_id, text_id, race_id, seq_index);
+
+ALTER TABLE public.keystrokes
+    ADD CONSTRAINT keystrokes_text_id_fkey FOREIGN KEY (text_id) REFERENCES public.texts(text_id);
+
+ALTER TABLE public.keystrokes
+    ADD CONSTRAINT keystrokes_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(user_id);
+
+CREATE INDEX keystrokes_forward_idx ON public.keystrokes (user_id)
+    INCLUDE (ch_prev, ch, ms, race_date)
+    WHERE forward AND forward_prev AND seq_index > 1;
+
+CREATE INDEX keystrokes_race_ch_idx ON public.keystrokes (user_id, race_id, ch_index)
+    INCLUDE (seq_index, ms, forward, forward_prev, ch_prev, ch);
+
+CREATE INDEX keystrokes_race_date_brin ON public.keystrokes USING brin (race_date);
+
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE public.keystrokes TO typescraper;
+
+ANALYZE public.keystrokes;
@@ -0,0 +1,35 @@
+--
+-- Per-user, per-day latency aggregates for every bigram, kept up to date
+-- by copy_upsert as keystrokes are merged (see AGGREGATES in utils/db.py).
+-- Holds enough to derive count, mean, variance, min and max over any set
+-- of days without reading keystrokes.
+--
+
+CREATE TABLE public.bigram_stats (
+    user_id integer NOT NULL,
+    day date NOT NULL,
+    ch_prev character(1) NOT NULL,
+    ch character(1) NOT NULL,
+    forward_prev boolean NOT NULL,
+    forward boolean NOT NULL,
+    n bigint NOT NULL,
+    ms_sum bigint NOT NULL,
+    ms_sq bigint NOT NULL,
+    ms_min integer,
+    ms_max integer
+);
+
+ALTER TABLE ONLY public.bigram_stats
+    ADD CONSTRAINT bigram_stats_pkey PRIMARY KEY (user_id, day, ch_prev, ch, forward_prev, forward);
+
+ALTER TABLE ONLY public.bigram_stats
+    ADD CONSTRAINT bigram_stats_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(user_id);
+
+INSERT INTO public.bigram_stats
+SELECT user_id, race_date::date, ch_prev, ch, forward_prev, forward,
+       count(ms), coalesce(sum(ms), 0), coalesce(sum(ms::bigint * ms), 0), min(ms), max(ms)
+FROM public.keystrokes
+WHERE ch_prev IS NOT NULL AND ch IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5, 6;
+
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE public.bigram_stats TO typescraper;
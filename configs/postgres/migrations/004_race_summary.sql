@@ -0,0 +1,38 @@
+--
+-- One row per race with its totals, written alongside the race's
+-- keystrokes by copy_upsert (see AGGREGATES in utils/db.py) and
+-- backfilled here from existing keystrokes.
+--
+
+CREATE TABLE public.race_summary (
+    user_id integer NOT NULL,
+    race_id integer NOT NULL,
+    text_id integer NOT NULL,
+    race_date timestamp without time zone,
+    keystrokes integer NOT NULL,
+    total_ms bigint NOT NULL,
+    backspaces integer NOT NULL,
+    mistake_score double precision,
+    mean_forward_ms double precision,
+    text_length integer
+);
+
+ALTER TABLE ONLY public.race_summary
+    ADD CONSTRAINT race_summary_pkey PRIMARY KEY (user_id, race_id);
+
+ALTER TABLE ONLY public.race_summary
+    ADD CONSTRAINT race_summary_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(user_id);
+
+ALTER TABLE ONLY public.race_summary
+    ADD CONSTRAINT race_summary_text_id_fkey FOREIGN KEY (text_id) REFERENCES public.texts(text_id);
+
+INSERT INTO public.race_summary
+SELECT m.user_id, m.race_id, m.text_id, min(m.race_date), count(*), coalesce(sum(m.ms), 0),
+       sum(CASE WHEN m.forward THEN 0 ELSE 1 END),
+       cast(sum(CASE WHEN m.forward THEN 0 ELSE m.ms END) AS float) / nullif(sum(m.ms), 0),
+       avg(CASE WHEN m.forward AND m.forward_prev AND m.seq_index > 1 THEN m.ms END),
+       max(length(t.raw_text))
+FROM public.keystrokes m JOIN public.texts t ON t.text_id = m.text_id
+GROUP BY m.user_id, m.race_id, m.text_id;
+
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE public.race_summary TO typescraper;
@@ -0,0 +1,22 @@
+--
+-- A counter per user, bumped in the same transaction as every write of
+-- their keystrokes or WPM rows (and every re-ingest), so cached analytics
+-- results can tell when a user's data changed even if its row counts
+-- didn't. See PostgresStorage.bump_versions and utils.cache.QueryCache.
+--
+
+CREATE TABLE public.ingest_versions (
+    user_id integer NOT NULL,
+    version integer NOT NULL
+);
+
+ALTER TABLE ONLY public.ingest_versions
+    ADD CONSTRAINT ingest_versions_pkey PRIMARY KEY (user_id);
+
+ALTER TABLE ONLY public.ingest_versions
+    ADD CONSTRAINT ingest_versions_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(user_id);
+
+INSERT INTO public.ingest_versions
+SELECT user_id, 1 FROM public.users;
+
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE public.ingest_versions TO typescraper;
@@ -0,0 +1,8 @@
+--
+-- KeyboardLoader creates the table of a new layout (such as one written by
+-- utils.optimize) on its first load. Since Postgres 15 only the database
+-- owner can create tables in public, so typescraper is granted it here.
+-- Reloading an existing layout does not need it.
+--
+
+GRANT CREATE ON SCHEMA public TO typescraper;
@@ -0,0 +1,113 @@
+--
+-- SQLite schema mirroring configs/postgres/typeracerdb.sql and its migrations.
+--
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id integer PRIMARY KEY,
+    username varchar(32),
+    type varchar
+);
+
+CREATE TABLE IF NOT EXISTS texts (
+    text_id integer PRIMARY KEY,
+    raw_text text
+);
+
+CREATE TABLE IF NOT EXISTS keystrokes (
+    text_id integer NOT NULL REFERENCES texts(text_id),
+    user_id integer NOT NULL REFERENCES users(user_id),
+    race_date timestamp,
+    race_id integer NOT NULL,
+    ch_prev character(1),
+    ch character(1),
+    ms integer,
+    forward_prev boolean,
+    forward boolean,
+    ch_index integer,
+    seq_index integer NOT NULL,
+    PRIMARY KEY (user_id, text_id, race_id, seq_index)
+);
+
+CREATE TABLE IF NOT EXISTS wpm (
+    user_id integer NOT NULL REFERENCES users(user_id),
+    race_date timestamp NOT NULL,
+    race_id integer NOT NULL,
+    wpm integer,
+    accuracy real,
+    PRIMARY KEY (user_id, race_date, race_id)
+);
+
+CREATE TABLE IF NOT EXISTS qwerty (
+    ch character(1),
+    hand character(1),
+    digit integer,
+    shifted boolean,
+    "row" integer,
+    col integer,
+    UNIQUE ("row", col, shifted)
+);
+
+CREATE TABLE IF NOT EXISTS dvorak (
+    ch character(1),
+    hand character(1),
+    digit integer,
+    shifted boolean,
+    "row" integer,
+    col integer,
+    UNIQUE ("row", col, shifted)
+);
+
+CREATE TABLE IF NOT EXISTS colemak (
+    ch character(1),
+    hand character(1),
+    digit integer,
+    shifted boolean,
+    "row" integer,
+    col integer,
+    UNIQUE ("row", col, shifted)
+);
+
+-- Analytics indexes from migration 002 (SQLite has no partitioning).
+CREATE INDEX IF NOT EXISTS keystrokes_forward_idx ON keystrokes (user_id, ch_prev, ch, ms, race_date)
+    WHERE forward AND forward_prev AND seq_index > 1;
+
+CREATE INDEX IF NOT EXISTS keystrokes_race_ch_idx ON keystrokes (user_id, race_id, ch_index, seq_index, ms, forward);
+
+CREATE INDEX IF NOT EXISTS keystrokes_race_date_idx ON keystrokes (race_date);
+
+-- Bigram latency aggregates from migration 003.
+CREATE TABLE IF NOT EXISTS bigram_stats (
+    user_id integer NOT NULL REFERENCES users(user_id),
+    day date NOT NULL,
+    ch_prev character(1) NOT NULL,
+    ch character(1) NOT NULL,
+    forward_prev boolean NOT NULL,
+    forward boolean NOT NULL,
+    n integer NOT NULL,
+    ms_sum integer NOT NULL,
+    ms_sq integer NOT NULL,
+    ms_min integer,
+    ms_max integer,
+    PRIMARY KEY (user_id, day, ch_prev, ch, forward_prev, forward)
+);
+
+-- Per-race totals from migration 004.
+CREATE TABLE IF NOT EXISTS race_summary (
+    user_id integer NOT NULL REFERENCES users(user_id),
+    race_id integer NOT NULL,
+    text_id integer NOT NULL REFERENCES texts(text_id),
+    race_date timestamp,
+    keystrokes integer NOT NULL,
+    total_ms integer NOT NULL,
+    backspaces integer NOT NULL,
+    mistake_score real,
+    mean_forward_ms real,
+    text_length integer,
+    PRIMARY KEY (user_id, race_id)
+);
+
+-- Ingest versions from migration 005.
+CREATE TABLE IF NOT EXISTS ingest_versions (
+    user_id integer PRIMARY KEY REFERENCES users(user_id),
+    version integer NOT NULL
+);
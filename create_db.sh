@@ -1,2 +1,3 @@
 createdb typeracer
 psql typeracer < configs/postgres/typeracerdb.sql
+./migrate.sh typeracer
@@ -1,14 +1,21 @@
 import os
 import json
+from functools import lru_cache
+
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 
+@lru_cache(maxsize=None)
+def read_image(path):
+    return plt.imread(path)
+
+
 class Keyboard:
 
-    def __init__(self, cfg):
+    def __init__(self, cfg, figure=None):
         with open(cfg) as json_file:
             self.cfg = json.load(json_file)
         self.img_file = os.path.join(os.path.dirname(cfg), self.cfg["image"])
@@ -18,6 +25,13 @@ class Keyboard:
         self.key_map = self.__make_map()
         self.left_shift = self.cfg["left_shift"] 
         self.right_shift = self.cfg["right_shift"] 
+        self.char_index = self.__make_index()
+        # Characters left out of the last heatmap or colormap fill because
+        # the keyboard doesn't have them.
+        self.skipped = []
+        # Plots go on this figure, cleared each time, when given (e.g. an
+        # Agg figure reused for batch rendering), else on a new pyplot one.
+        self.figure = figure
 
     def __reset_heatmap(self):
         self.heatmap = np.zeros(self.shape)
@@ -39,52 +53,92 @@ class Keyboard:
             char_map[key] = ((x1, y1), (x2, y2))
         return char_map
     
+    def __make_index(self):
+        # Edges of the first key in key_map each character appears in and
+        # of the shift key it needs, if any. Characters not in it are not on
+        # the keyboard.
+        index = {}
+        for key, edges in self.key_map.items():
+            for char in key:
+                if char not in index:
+                    index[char] = (edges, self.__shift_edges(char))
+        return index
+
+    def __shift_edges(self, char):
+        if char in self.left_shift:
+            return self.key_map['lshift']
+        elif char in self.right_shift:
+            return self.key_map['rshift']
+        return None
+
+    def __lookup(self, char):
+        try:
+            return self.char_index[char]
+        except (KeyError, TypeError):
+            raise KeyError(f'{char} not found in the map')
+
+    def __on_keyboard(self, char_dict):
+        # Items of char_dict whose characters the keyboard has; the rest are
+        # kept in skipped and reported.
+        self.skipped = sorted(str(char) for char in char_dict if char not in self.char_index)
+        if self.skipped:
+            print(f"Skipping characters not on the keyboard: {' '.join(self.skipped)}")
+        return [(char, value) for char, value in char_dict.items() if char in self.char_index]
+
+    def __regions(self, char):
+        edges, shift_edges = self.__lookup(char)
+        return (edges,) if shift_edges is None else (edges, shift_edges)
+
+    @staticmethod
+    def get_slices(e):
+        return slice(e[0][0], e[1][0]), slice(e[0][1], e[1][1])
+
     def get_cells(self, e):
         row_range = range(e[0][0], e[1][0])
         col_range = range(e[0][1], e[1][1])
         return [(r,c) for r in row_range for c in col_range]
     
     def get_cells_for_char(self, char):
-        try:
-            char_map = self.key_map
-            key = [x for x in char_map.keys() if char in x][0]
-            cell_edges = char_map[key]
-            cells = self.get_cells(cell_edges)
-            if char in self.left_shift:
-                cells += self.get_cells(char_map['lshift'])
-            elif char in self.right_shift:
-                cells += self.get_cells(char_map['rshift'])
-            return cells
-        except Exception:
-            raise KeyError(f'{char} not found in the map')
+        cells = []
+        for edges in self.__regions(char):
+            cells += self.get_cells(edges)
+        return cells
         
     def __fill_heatmap(self, char_dict):
-        for char, freq in char_dict.items():
-            self.__fill_freq(char, freq)
-        self.heatmap /= np.sum(self.heatmap)
-        
-    def __fill_freq(self, char, freq):
-        cells = self.get_cells_for_char(char)
-        for r,c in cells:
-            self.heatmap[r][c] += freq 
+        totals = {}
+        for char, freq in self.__on_keyboard(char_dict):
+            for edges in self.__regions(char):
+                totals[edges] = totals.get(edges, 0) + freq
+        for edges, freq in totals.items():
+            self.heatmap[self.get_slices(edges)] += freq
+        total = np.sum(self.heatmap)
+        if total:
+            self.heatmap /= total
             
     def fill_color(self, char, color):
-        cells = self.get_cells_for_char(char)
-        value = np.array(matplotlib.colors.to_rgb(color))
-        for r,c in cells:
-            self.colormap[r][c] += value 
+        self.fill_colors({char: color})
+
+    def fill_colors(self, char_dict):
+        totals = {}
+        for char, color in self.__on_keyboard(char_dict):
+            value = np.array(matplotlib.colors.to_rgb(color))
+            for edges in self.__regions(char):
+                totals[edges] = totals.get(edges, 0) + value
+        for edges, value in totals.items():
+            self.colormap[self.get_slices(edges)] += value
 
     def scale(self, char, factor):
         if char in ("lshift", "rshift"):
-            cells = self.get_cells(self.key_map[char])
+            edges = self.key_map[char]
         else:
-            key = [x for x in self.key_map.keys() if char in x][0]
-            cell_edges = self.key_map[key]
-            cells = self.get_cells(cell_edges)
-        for r, c in cells:
-            self.heatmap[r][c] *= factor
+            edges = self.__lookup(char)[0]
+        self.heatmap[self.get_slices(edges)] *= factor
 
     def make_heatmap(self, data, alpha=0.8, save=False, op_path=None, **kwargs):
+        self.set_heatmap(data)
+        self.show_heatmap(alpha, save, op_path, **kwargs)
+
+    def set_heatmap(self, data):
         self.__reset_heatmap()
         normalize = True
         if isinstance(data, dict):
@@ -96,7 +150,6 @@ class Keyboard:
         else:
             print('Datatype not handled yet')
             raise Exception("Unknown datatype, can not make image")
-        self.show_heatmap(alpha, save, op_path, **kwargs)
 
     def show_heatmap(self, alpha=0.8, save=False, op_path=None, **kwargs):
         self.start_plot()
@@ -124,14 +177,18 @@ class Keyboard:
         self.__reset_colormap()
         
     def start_plot(self):
-        self.fig, self.ax = plt.subplots()
-        plt.xticks([])
-        plt.yticks([])
-        plt.axis('off')
+        if self.figure is None:
+            self.fig, self.ax = plt.subplots()
+        else:
+            self.figure.clear()
+            self.fig, self.ax = self.figure, self.figure.add_subplot()
+        self.ax.set_xticks([])
+        self.ax.set_yticks([])
+        self.ax.axis('off')
         self.fig.set_size_inches(15, 45)
     
     def finish_plot(self, save=False, op_path=None):
-        img = plt.imread(self.img_file) 
+        img = read_image(self.img_file)
         self.ax.imshow(img, zorder=0, extent=[0, self.shape[1], self.shape[0], 0])
         if save:
             self.save(op_path)
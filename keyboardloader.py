@@ -2,27 +2,28 @@ import os
 import argparse
 import re
 
-import psycopg2
 import pandas as pd
 
-from utils.db import df_to_postgres
+from utils.db import LAYOUT_KEY
+from utils.storage import get_storage
 
 
 class KeyboardLoader:
 
-    def __init__(self, filepath):
-        self.conn = psycopg2.connect(dbname="typeracer", user="typescraper")
-        self.cur = self.conn.cursor()
+    def __init__(self, filepath, db=None):
+        self.storage = get_storage(db)
         self.table_name = os.path.basename(filepath).split('.')[0]
         self.key_map = pd.read_csv(filepath)
         self.key_map.row = self.key_map.row.astype(int)
 
     def __call__(self):
-        df_to_postgres(self.key_map, self.table_name, self.conn)
+        self.storage.create_layout(self.table_name)
+        self.storage.upsert(self.key_map, self.table_name, update=True, key=LAYOUT_KEY)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("filepath")
+    parser.add_argument("--db", default=None, help="sqlite:///path.db for a local file, default $TYPESCRAPER_DB or postgres")
     args = parser.parse_args()
-    kb_loader = KeyboardLoader(args.filepath)
+    kb_loader = KeyboardLoader(args.filepath, db=args.db)
     kb_loader()
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FEATURES = ["hand", "digit", "shifted", "row", "col"]
+
+
+class Layout:
+    """
+    A keyboard layout (one row per key: ch, hand, digit, shifted, row, col)
+    compiled into arrays indexed by character code, so the features of a
+    whole column of characters are one numpy take instead of a DataFrame
+    join. Code 0 stands for nulls and characters the layout doesn't have.
+    """
+
+    def __init__(self, key_map, name=None):
+        self.name = name
+        self.key_map = key_map[key_map.ch.notna() & (key_map.ch != "")].reset_index(drop=True)
+        codes = self.codes(self.key_map.ch)
+        self.size = int(codes.max()) + 1
+        self.known = np.zeros(self.size, dtype=bool)
+        self.known[codes] = True
+        self.arrays = {}
+        for feature in FEATURES:
+            values = self.key_map[feature].to_numpy()
+            fill = None if values.dtype == object else 0
+            self.arrays[feature] = np.full(self.size, fill, dtype=values.dtype)
+            self.arrays[feature][codes] = values
+
+    @classmethod
+    def from_csv(cls, path, name=None):
+        key_map = pd.read_csv(path)
+        key_map.shifted = key_map.shifted.astype(bool)
+        return cls(key_map, name=name or os.path.basename(path).split('.')[0])
+
+    @classmethod
+    def from_db(cls, storage, name):
+        """Loads the table KeyboardLoader wrote; storage may also be a QueryCache."""
+        query = f"select * from {name}"
+        if hasattr(storage, "cached"):
+            return cls(storage.read_sql(query, tables=[name]), name=name)
+        return cls(storage.read_sql(query), name=name)
+
+    @classmethod
+    def load(cls, name, storage=None):
+        if storage is None:
+            return cls.from_csv(os.path.join(BASE_DIR, "configs", name, f"{name}.csv"))
+        return cls.from_db(storage, name)
+
+    @staticmethod
+    def codes(chars):
+        """Code points of a column of single characters, 0 for nulls."""
+        chars = pd.Series(chars).fillna("").to_numpy(dtype="U1")
+        return chars.view(np.uint32)
+
+    def index(self, chars):
+        codes = self.codes(chars)
+        return np.where(codes < self.size, codes, 0)
+
+    def bigram_features(self, ch_prev, ch, suffixes=("_prev", "")):
+        """
+        Returns the features of both keys of every bigram, and a mask of the
+        bigrams the layout can type.
+        """
+        prev, index = self.index(ch_prev), self.index(ch)
+        columns = {}
+        for idx, suffix in zip((prev, index), suffixes):
+            for feature, array in self.arrays.items():
+                columns[f"{feature}{suffix}"] = array[idx]
+        return columns, self.known[prev] & self.known[index]
+
+    def annotate(self, df, prev="ch_prev", ch="ch", suffixes=("_prev", "")):
+        """
+        Adds the features of both keys to the bigrams in df and drops the
+        ones the layout can't type, like an inner join on both characters.
+        """
+        columns, known = self.bigram_features(df[prev], df[ch], suffixes)
+        df = pd.concat([df, pd.DataFrame(columns, index=df.index)], axis=1)
+        return df[known].reset_index(drop=True)
@@ -0,0 +1,12 @@
+DB=${1:-typeracer}
+psql -q $DB -c "set client_min_messages = warning; create table if not exists schema_migrations (version text primary key, applied_at timestamp default now())"
+for migration in configs/postgres/migrations/*.sql; do
+    version=$(basename $migration .sql)
+    applied=$(psql -tA $DB -c "select 1 from schema_migrations where version = '$version'")
+    if [ -z "$applied" ]; then
+        echo "Applying $version"
+        psql -q -v ON_ERROR_STOP=1 --single-transaction $DB \
+            -f $migration \
+            -c "insert into schema_migrations(version) values('$version')" || exit 1
+    fi
+done
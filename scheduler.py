@@ -0,0 +1,108 @@
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, ALL_COMPLETED, FIRST_COMPLETED
+from itertools import chain, zip_longest
+
+from typescraper import TypeScraper, build_race, add_reingest_argument, add_scraper_arguments, scraper_kwargs
+from wpmscraper import WPMScraper
+from utils.http import bounded_map
+
+
+class Scheduler:
+    """
+    Scrapes a whole cohort from one process: race pages for every user are
+    interleaved into a single work queue, fetched on a pool of I/O threads,
+    extracted and turned into keystroke rows on a process pool, and written
+    through one shared storage backend and batch writer.
+    """
+
+    def __init__(self, processes=None, **kwargs):
+        self.scraper = TypeScraper(**kwargs)
+        self.processes = processes
+        self.total = Counter()
+        self.done = Counter()
+
+    def queue(self, users):
+        plans = []
+        for user in users:
+            user_id, population = self.scraper.plan(user)
+            self.total[user] = len(population)
+            print(f"{user}: {len(population)} races to scrape")
+            plans.append([(user, user_id, race_id) for race_id in population])
+        return [item for item in chain(*zip_longest(*plans)) if item]
+
+    def fetch(self, item):
+        user, _, race_id = item
+        return self.scraper.fetch_race(user, race_id)
+
+    def scrape(self, users):
+        work = self.queue(users)
+        limit = 4 * (self.processes or 1)
+        pending = {}
+        with self.scraper.writer, ProcessPoolExecutor(self.processes) as pool:
+            for item, html in bounded_map(self.fetch, work, self.scraper.workers):
+                if html is None:
+                    self.progress(item)
+                    continue
+                user, user_id, race_id = item
+                future = pool.submit(build_race, self.scraper.extractor, user_id, race_id, html)
+                pending[future] = item
+                if len(pending) >= limit:
+                    self.drain(pending, FIRST_COMPLETED)
+            self.drain(pending)
+        for user in users:
+            self.scraper.finish(user)
+
+    def drain(self, pending, return_when=ALL_COMPLETED):
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            item = pending.pop(future)
+            race, action_df = future.result()
+            self.scraper.store_race(*item, race, action_df)
+            self.progress(item)
+
+    def progress(self, item):
+        user = item[0]
+        self.done[user] += 1
+        if self.done[user] % 100 == 0 or self.done[user] == self.total[user]:
+            print(f"{user}: {self.done[user]}/{self.total[user]} races")
+
+
+def read_users(args):
+    users = list(args.usernames)
+    if args.users_file:
+        with open(args.users_file) as f:
+            users += [line.strip() for line in f if line.strip()]
+    return list(dict.fromkeys(users))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("usernames", nargs="*")
+    arg_parser.add_argument("--users-file", help="file with one username per line")
+    arg_parser.add_argument("--workers", type=int, default=8, help="concurrent race fetches")
+    arg_parser.add_argument("--processes", type=int, default=None, help="parsing processes, defaults to all cores")
+    arg_parser.add_argument("--wpm", action="store_true", help="also scrape WPM history for every user")
+    add_scraper_arguments(arg_parser)
+    arg_parser.add_argument("--batch-rows", type=int, default=100000, help="keystrokes buffered per COPY")
+    arg_parser.add_argument("--batch-seconds", type=float, default=60, help="max seconds between flushes")
+    arg_parser.add_argument("--checkpoint-dir", default=".checkpoints", help="where interrupted scrapes are resumed from")
+    add_reingest_argument(arg_parser)
+    args = arg_parser.parse_args()
+    if args.reingest and not args.replay:
+        arg_parser.error("--reingest needs --replay")
+    users = read_users(args)
+    scheduler = Scheduler(
+        processes=args.processes,
+        workers=args.workers,
+        batch_rows=args.batch_rows,
+        batch_seconds=args.batch_seconds,
+        checkpoint_dir=args.checkpoint_dir,
+        reingest=args.reingest,
+        **scraper_kwargs(args),
+    )
+    scheduler.scrape(users)
+    if args.wpm:
+        wpms = WPMScraper(storage=scheduler.scraper.storage, **scraper_kwargs(args))
+        for user in users:
+            wpms.scrape(user)
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from keyboardloader import KeyboardLoader
+from layout import Layout
+from utils.cache import QueryCache
+from utils.db import BatchWriter
+from utils.keystrokes import race_keystrokes
+from utils.storage import get_storage
+
+SUMMARY = "select race_id, total_ms from race_summary where user_id = %s order by race_id"
+
+
+def write_race(storage, ms, replace=False):
+    with BatchWriter(storage, replace=replace) as writer:
+        writer.add_text(7, "the cat")
+        actions = [(ch, i, True, ms) for i, ch in enumerate("the cat")]
+        writer.add_keystrokes(race_keystrokes(7, 1, datetime(2020, 4, 4), 1, actions))
+
+
+def test_reingest_refreshes_results(tmp_path):
+    storage = get_storage(f"sqlite:///{tmp_path / 'typeracer.db'}")
+    storage.fetch_or_create_user("bob")
+    cache = QueryCache(storage, path=str(tmp_path / "queries"))
+    write_race(storage, 100)
+    assert cache.read_sql(SUMMARY, [1], user=1).total_ms.tolist() == [700]
+    write_race(storage, 50, replace=True)
+    assert cache.read_sql(SUMMARY, [1], user=1).total_ms.tolist() == [350]
+    assert cache.read_sql("select sum(ms_sum) as ms from bigram_stats").ms[0] == 300
+
+
+def test_table_edits_refresh_results(tmp_path):
+    storage = get_storage(f"sqlite:///{tmp_path / 'typeracer.db'}")
+    storage.fetch_or_create_user("bob")
+    cache = QueryCache(storage, path=str(tmp_path / "queries"))
+    users = lambda: cache.read_sql("select user_id, type from users", tables=["users"])
+    assert users().type.isna().all()
+    storage.execute("update users set type = 'dvorak'")
+    storage.commit()
+    assert users().type.tolist() == ["dvorak"]
+
+    db = f"sqlite:///{tmp_path / 'typeracer.db'}"
+    path = tmp_path / "personal.csv"
+    key_map = Layout.load("qwerty").key_map.assign(shifted=lambda df: df.shifted.astype(int))
+    key_map.to_csv(path, index=False)
+    KeyboardLoader(str(path), db=db)()
+    col = lambda ch: Layout.from_db(cache, "personal").key_map.set_index("ch").col[ch]
+    assert col("q") == 1
+    key_map.ch = key_map.ch.replace({"q": "w", "w": "q"})
+    key_map.to_csv(path, index=False)
+    KeyboardLoader(str(path), db=db)()
+    assert col("q") == 2
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+from utils.http import DEFAULT_MAX_RATE, MAX_RETRY_AFTER, HttpClient, TokenBucket, retry_after
+
+
+def response(retry_after=None):
+    r = requests.Response()
+    if retry_after is not None:
+        r.headers["Retry-After"] = retry_after
+    return r
+
+
+def test_rate_is_capped_by_default():
+    bucket = TokenBucket()
+    for _ in range(1000):
+        bucket.feedback(True)
+    assert bucket.rate == DEFAULT_MAX_RATE
+    assert HttpClient().bucket("https://data.typeracer.com/pit/").max_rate == DEFAULT_MAX_RATE
+    assert HttpClient(rate=1).bucket("https://data.typeracer.com/pit/").max_rate == 1
+
+
+def test_retry_after_seconds():
+    assert retry_after(response("3")) == 3
+    assert retry_after(response(str(10 * MAX_RETRY_AFTER))) == MAX_RETRY_AFTER
+    assert retry_after(response("-5")) == 0
+
+
+def test_retry_after_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert retry_after(response(format_datetime(when, usegmt=True))) == pytest.approx(30, abs=2)
+    when = datetime.now(timezone.utc) + timedelta(days=1)
+    assert retry_after(response(format_datetime(when, usegmt=True))) == MAX_RETRY_AFTER
+    assert retry_after(response("Wed, 21 Oct 2015 07:28:00 GMT")) == 0
+
+
+@pytest.mark.parametrize("value", [None, "soon", "inf", "nan", ""])
+def test_retry_after_unusable(value):
+    assert retry_after(response(value)) is None
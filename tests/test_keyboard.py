@@ -0,0 +1,23 @@
+import os
+
+import matplotlib
+import numpy as np
+
+matplotlib.use("Agg")
+
+from keyboard import Keyboard
+
+CONFIG = os.path.join(os.path.dirname(__file__), "..", "configs", "qwerty", "qwerty_config.json")
+
+
+def test_heatmap_skips_unknown_characters():
+    kb = Keyboard(CONFIG)
+    kb.set_heatmap("the caté—")
+    assert kb.skipped == ["é", "—"]
+    expected = Keyboard(CONFIG)
+    expected.set_heatmap("the cat")
+    assert np.array_equal(kb.heatmap, expected.heatmap)
+
+    kb.fill_colors({"a": "red", "é": "blue"})
+    assert kb.skipped == ["é"]
+    assert kb.colormap.any()
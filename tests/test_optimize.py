@@ -0,0 +1,33 @@
+import numpy as np
+
+from keyboardloader import KeyboardLoader
+from layout import Layout
+from utils.optimize import LayoutOptimizer, remap, write_layout
+from utils.smoothing import LayoutComparison
+from utils.storage import get_storage
+
+
+def test_optimized_layout_loads(tmp_path):
+    qwerty = Layout.load("qwerty")
+    comparison = LayoutComparison(qwerty, qwerty, [])
+    rng = np.random.default_rng(0)
+    freq = rng.integers(0, 50, (comparison.n, comparison.n))
+    cost = rng.uniform(50, 150, (comparison.n, comparison.n))
+    optimizer = LayoutOptimizer(freq, cost, fixed=np.flatnonzero(comparison.keys.row == -2))
+    optimizer.anneal(20000, seed=0)
+    assert (optimizer.assignment != np.arange(comparison.n)).any()
+
+    path = write_layout(remap(qwerty, comparison.keys, optimizer.assignment), "personal", tmp_path)
+    db = f"sqlite:///{tmp_path / 'typeracer.db'}"
+    KeyboardLoader(path, db=db)()
+    # Loading again updates the rows in place.
+    KeyboardLoader(path, db=db)()
+
+    columns = ["ch", "hand", "digit", "shifted", "row", "col"]
+    loaded = Layout.from_db(get_storage(db), "personal").key_map[columns]
+    expected = Layout.from_csv(path).key_map[columns]
+    assert len(loaded) == len(expected)
+    for key_map in (loaded, expected):
+        key_map.shifted = key_map.shifted.astype(bool)
+        key_map.sort_values(["row", "col", "shifted"], inplace=True, ignore_index=True)
+    assert loaded.astype(object).equals(expected.astype(object))
@@ -0,0 +1,25 @@
+from psycopg2.extensions import make_dsn, parse_dsn
+
+import utils.storage
+from utils.storage import get_storage
+
+
+def connect_params(monkeypatch, url):
+    calls = []
+    monkeypatch.setattr(utils.storage.psycopg2, "connect", lambda *args, **kwargs: calls.append((args, kwargs)))
+    get_storage(url)
+    (args, kwargs), = calls
+    return parse_dsn(make_dsn(*args, **kwargs))
+
+
+def test_dsn_names_database(monkeypatch):
+    assert connect_params(monkeypatch, "dbname=tr2 user=typescraper") == {"dbname": "tr2", "user": "typescraper"}
+
+
+def test_url_names_database(monkeypatch):
+    assert connect_params(monkeypatch, "postgresql://typescraper@/tr2") == {"dbname": "tr2", "user": "typescraper"}
+
+
+def test_default_database(monkeypatch):
+    monkeypatch.delenv("TYPESCRAPER_DB", raising=False)
+    assert connect_params(monkeypatch, None) == {"dbname": "typeracer", "user": "typescraper"}
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import typescraper
+from typescraper import TypeScraper
+from utils.extract import RaceData
+from utils.storage import get_storage
+
+
+class RaceExtractor:
+
+    def race(self, html):
+        return RaceData(7, "the cat", datetime(2020, 4, 4, 13, 5), html)
+
+
+def actions(ms):
+    return [(ch, i, True, ms * (i + 1)) for i, ch in enumerate("the cat")]
+
+
+def scrape(tmp_path, monkeypatch, ms, **kwargs):
+    monkeypatch.setattr(typescraper, "parse_log", lambda log: actions(ms))
+    scraper = TypeScraper(
+        storage=get_storage(f"sqlite:///{tmp_path / 'typeracer.db'}"),
+        checkpoint_dir=str(tmp_path / "checkpoints"),
+        replay=True,
+        **kwargs,
+    )
+    scraper.extractor = RaceExtractor()
+    scraper.get_max_race = lambda user: 2
+    scraper.fetch_race = lambda user, race_id: race_id
+    scraper.scrape("bob")
+    return scraper.storage
+
+
+def test_reingest_replaces_races(tmp_path, monkeypatch):
+    scrape(tmp_path, monkeypatch, ms=100)
+    # Without reingest, races already in the database are left alone.
+    storage = scrape(tmp_path, monkeypatch, ms=50)
+    assert storage.read_sql("select sum(ms) as ms from keystrokes").ms[0] == 2 * 2800
+
+    storage = scrape(tmp_path, monkeypatch, ms=50, reingest=True)
+    keystrokes = storage.read_sql("select * from keystrokes order by race_id, seq_index")
+    assert len(keystrokes) == 14
+    assert keystrokes.ms.tolist() == [50 * (i + 1) for i in range(7)] * 2
+
+    summary = storage.read_sql("select * from race_summary order by race_id")
+    assert summary.race_id.tolist() == [1, 2]
+    assert summary.total_ms.tolist() == [1400, 1400]
+
+    stats = storage.read_sql("select ch_prev, ch, n, ms_sum, ms_min, ms_max from bigram_stats order by ch_prev, ch")
+    expected = (
+        keystrokes[keystrokes.ch_prev.notna()]
+        .groupby(["ch_prev", "ch"]).ms.agg(["count", "sum", "min", "max"]).reset_index()
+    )
+    assert stats.n.tolist() == expected["count"].tolist()
+    assert stats.ms_sum.tolist() == expected["sum"].tolist()
+    assert stats.ms_min.tolist() == expected["min"].tolist()
+    assert stats.ms_max.tolist() == expected["max"].tolist()
+
+
+def test_reingest_checkpoints_committed_races(tmp_path, monkeypatch):
+    scrape(tmp_path, monkeypatch, ms=100)
+    monkeypatch.setattr(typescraper, "parse_log", lambda log: actions(50))
+    scraper = TypeScraper(
+        storage=get_storage(f"sqlite:///{tmp_path / 'typeracer.db'}"),
+        checkpoint_dir=str(tmp_path / "checkpoints"),
+        replay=True,
+        reingest=True,
+        batch_rows=1,
+    )
+    scraper.extractor = RaceExtractor()
+    scraper.get_max_race = lambda user: 2
+    scraper.fetch_race = lambda user, race_id: race_id
+    # The first race's batch rolls back, the second's commits; the run is
+    # interrupted before the checkpoint is removed.
+    delete_races = scraper.storage.delete_races
+
+    def fail_race_1(races):
+        if 1 in races.race_id.tolist():
+            raise RuntimeError("lost connection")
+        delete_races(races)
+
+    monkeypatch.setattr(scraper.storage, "delete_races", fail_race_1)
+    monkeypatch.setattr(scraper, "finish", lambda user: None)
+    scraper.scrape("bob")
+    assert scraper.load_checkpoint("bob")["reingested"] == [2]
+
+    # Resuming re-ingests only the rolled back race.
+    monkeypatch.setattr(scraper.storage, "delete_races", delete_races)
+    user_id, population = scraper.plan("bob")
+    assert population == [1]
@@ -0,0 +1,94 @@
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pytest
+from requests import HTTPError
+
+import wpmscraper
+from utils.storage import get_storage
+from wpmscraper import WPMScraper
+
+
+def history(days):
+    """A race history with races[d] races on the d-th day of 2020, oldest first."""
+    rows = []
+    for day, races in enumerate(days):
+        start = datetime(2020, 1, 1) + timedelta(days=day)
+        rows += [start + timedelta(minutes=5 * i) for i in range(races)]
+    return pd.DataFrame({
+        "user_id": 1,
+        "race_date": rows,
+        "race_id": range(1, len(rows) + 1),
+        "wpm": 100,
+        "accuracy": .98,
+    })
+
+
+def serve(races, requests):
+    """race_history: the latest n races on or before the end of startDate."""
+
+    def fetch_history(user, user_id, date=None, n=100):
+        requests.append((date, n))
+        page = races[races.race_date.dt.strftime("%Y-%m-%d") <= date] if date else races
+        page = page.sort_values("race_id", ascending=False).head(n)
+        return page.reset_index(drop=True) if len(page) else None
+
+    return fetch_history
+
+
+def scraper(tmp_path, races, requests):
+    scraper = WPMScraper(storage=get_storage(f"sqlite:///{tmp_path / 'typeracer.db'}"))
+    scraper.fetch_history = serve(races, requests)
+    return scraper
+
+
+def test_crawl_window_pages_through_busy_day(tmp_path):
+    races = history([30, 250, 40, 20])
+    requests = []
+    df = scraper(tmp_path, races, requests).crawl_window("user", 1, date(2020, 1, 1), date(2020, 1, 3))
+    assert sorted(df.race_id.unique()) == races.race_id.tolist()
+    assert max(n for _, n in requests) == 400
+
+
+def test_crawl_window_warns_when_stuck(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(wpmscraper, "MAX_HISTORY_PAGE", 200)
+    races = history([30, 250, 40])
+    requests = []
+    df = scraper(tmp_path, races, requests).crawl_window("user", 1, date(2020, 1, 1), date(2020, 1, 2))
+    assert "more than 200 races on 2020-01-02" in capsys.readouterr().out
+    assert len(df.race_id.unique()) == 240
+    assert requests[-1] == ("2020-01-02", 200)
+
+
+RACE_PAGE = """<html><body>
+<table class="raceDetails">
+<tr>
+<td>Race Number</td>
+<td>1</td>
+</tr>
+<tr>
+<td>Date</td>
+<td>Wed, 1 Jan 2020 13:05:02 </td>
+</tr>
+</table>
+</body></html>"""
+
+
+@pytest.mark.parametrize("extractor", ["auto", "fast", "soup"])
+def test_date_span_without_typing_log(tmp_path, extractor):
+    requests = []
+    scraper = WPMScraper(storage=get_storage(f"sqlite:///{tmp_path / 'typeracer.db'}"), extractor=extractor)
+    scraper.fetch_history = serve(history([30, 250, 40]), requests)
+    scraper.http.get = lambda url, fresh=False: RACE_PAGE
+    assert scraper.date_span("user", 1) == (date(2020, 1, 1), date(2020, 1, 3))
+
+
+def test_date_span_fetch_error(tmp_path):
+    scraper = WPMScraper(storage=get_storage(f"sqlite:///{tmp_path / 'typeracer.db'}"))
+    scraper.fetch_history = serve(history([30]), [])
+
+    def get(url, fresh=False):
+        raise HTTPError("404 for " + url)
+
+    scraper.http.get = get
+    assert scraper.date_span("user", 1) is None
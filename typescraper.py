@@ -1,176 +1,274 @@
+import os
+import json
 import argparse
 import pdb
-from dateutil import parser
-from collections import deque
 import random
-import re
 
-import psycopg2
-import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 
-from utils.db import df_to_postgres
+from utils.cache import PageCache
+from utils.db import BatchWriter
+from utils.extract import EXTRACTORS
+from utils.http import HttpClient, bounded_map
+from utils.keystrokes import race_keystrokes
+from utils.storage import get_storage
+from utils.typinglog import parse_log
 
 
 class Scraper:
 
-    def __init__(self, max_races=5000):
+    def __init__(
+        self,
+        max_races=5000,
+        workers=1,
+        rate=None,
+        cache_dir=None,
+        cache_size=2048,
+        replay=False,
+        extractor="auto",
+        timeout=30,
+        retries=5,
+        db=None,
+        storage=None,
+    ):
         self.base = 'https://data.typeracer.com/pit/'
-        self.conn = psycopg2.connect(dbname="typeracer", user="typescraper")
-        self.cur = self.conn.cursor()
+        self.storage = storage or get_storage(db)
         self.max_races = max_races
+        self.workers = workers
+        self.replay = replay
+        cache = PageCache(cache_dir, max_bytes=cache_size * 1024 ** 2) if cache_dir else None
+        self.http = HttpClient(
+            pool_size=workers,
+            rate=rate,
+            cache=cache,
+            replay=replay,
+            timeout=timeout,
+            retries=retries,
+        )
+        self.extractor = EXTRACTORS[extractor]()
 
     def fetch_or_create_user(self, user):
-        self.cur.execute(
-            "select user_id from users where username=%s",
-            [user],
-        )
-        user_id = self.cur.fetchone()
-        if not user_id:
-            self.cur.execute(
-                """
-                    insert into users(username)
-                    values(%s)
-                    returning user_id
-                """,
-                [user],
-            )
-            user_id = self.cur.fetchone()
-            self.conn.commit()
-        return user_id[0]
+        return self.storage.fetch_or_create_user(user)
         
-    def bsoup(self, query):
+    def bsoup(self, query, fresh=False):
         print(self.base + query)
-        r  = requests.get(self.base + query)
-        return BeautifulSoup(r.text, 'html.parser')
+        html = self.http.get(self.base + query, fresh=fresh)
+        if html is None:
+            return None
+        return BeautifulSoup(html, 'html.parser')
+
+
+def add_scraper_arguments(arg_parser):
+    arg_parser.add_argument("--rate", type=float, default=None, help="max requests per second per host, default 4")
+    arg_parser.add_argument("--timeout", type=float, default=30, help="read timeout in seconds")
+    arg_parser.add_argument("--retries", type=int, default=5, help="retries for throttled or failed requests")
+    arg_parser.add_argument("--cache-dir", default=".cache/pages", help="raw page cache, empty to disable")
+    arg_parser.add_argument("--cache-size", type=int, default=2048, help="page cache size in MB")
+    arg_parser.add_argument("--replay", action="store_true", help="only read pages from the cache")
+    arg_parser.add_argument("--extractor", choices=EXTRACTORS, default="auto", help="page parsing strategy")
+    arg_parser.add_argument("--db", default=None, help="sqlite:///path.db for a local file, default $TYPESCRAPER_DB or postgres")
+
+
+def add_reingest_argument(arg_parser):
+    arg_parser.add_argument(
+        "--reingest",
+        action="store_true",
+        help="with --replay, re-parse races already in the database and replace their rows",
+    )
+
+
+def scraper_kwargs(args):
+    return dict(
+        rate=args.rate,
+        timeout=args.timeout,
+        retries=args.retries,
+        cache_dir=args.cache_dir or None,
+        cache_size=args.cache_size,
+        replay=args.replay,
+        extractor=args.extractor,
+        db=args.db,
+    )
+
+
+def build_race(extractor, user_id, race_id, html):
+    """
+    Extracts a race page and builds its keystrokes rows. Kept at module level
+    so it can run in a process pool; returns (None, None) for pages without
+    a typing log.
+    """
+    race = extractor.race(html)
+    if not race:
+        return None, None
+    action_df = race_keystrokes(
+        race.text_id, user_id, race.race_date, race_id, parse_log(race.log)
+    )
+    return race, action_df
 
 
 class TypeScraper(Scraper):
 
-    def load_text(self, text_id, raw_text):
-        self.cur.execute(
-            "insert into texts(text_id, raw_text) values(%s, %s) on conflict do nothing",
-            [text_id, raw_text],
+    def __init__(self, batch_rows=100000, batch_seconds=60, checkpoint_dir=".checkpoints", reingest=False, **kwargs):
+        super().__init__(**kwargs)
+        self.reingest = reingest
+        self.writer = BatchWriter(
+            self.storage,
+            max_rows=batch_rows,
+            max_seconds=batch_seconds,
+            on_commit=self.commit_batch,
+            on_rollback=self.rollback_batch,
+            replace=reingest,
         )
-        self.conn.commit()
+        # Races re-ingested in the batch being written, as (user, race_id).
+        self.reingested = []
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoints = {}
+        self.scraped = {}
+
+    def load_text(self, text_id, raw_text):
+        self.writer.add_text(text_id, raw_text)
 
     def scrape(self, user):
+        user_id, population = self.plan(user)
+        with self.writer:
+            if self.workers > 1:
+                self.scrape_concurrent(user, user_id, population)
+            else:
+                for i, race_id in enumerate(population):
+                    print(i, race_id)
+                    self.fetch_user_data(user, user_id, race_id)
+        self.finish(user)
+
+    def plan(self, user):
+        """
+        Returns the user's id and the races left to scrape, resuming from the
+        user's checkpoint if a previous run was interrupted. When
+        re-ingesting, races already in the database are scraped again.
+        """
         user_id = self.fetch_or_create_user(user)
-        max_race_id = self.get_max_race(user)
-        population = range(1, max_race_id + 1)
-        if max_race_id > self.max_races:
-            population = random.sample(population, self.max_races)
-        for i, race_id in enumerate(population):
+        scraped = set() if self.reingest else self.load_scraped(user_id)
+        checkpoint = self.load_checkpoint(user)
+        if checkpoint:
+            population = checkpoint["population"]
+            scraped |= set(checkpoint["skipped"] + checkpoint.get("reingested", []))
+            print(f"Resuming {user}: {len(scraped)} races already scraped")
+        else:
+            max_race_id = self.get_max_race(user)
+            population = range(1, max_race_id + 1)
+            if max_race_id > self.max_races and not self.replay:
+                population = random.sample(population, self.max_races)
+            checkpoint = {"user": user, "population": list(population), "skipped": []}
+        self.scraped[user_id] = scraped
+        self.checkpoints[user] = checkpoint
+        self.save_checkpoints()
+        return user_id, [race_id for race_id in population if race_id not in scraped]
+
+    def commit_batch(self):
+        for user, race_id in self.reingested:
+            self.checkpoints[user].setdefault("reingested", []).append(race_id)
+        self.reingested = []
+        self.save_checkpoints()
+
+    def rollback_batch(self):
+        # Rolled back races stay out of the checkpoint, so a resumed run
+        # re-ingests them.
+        self.reingested = []
+
+    def finish(self, user):
+        del self.checkpoints[user]
+        os.remove(self.checkpoint_path(user))
+
+    def checkpoint_path(self, user):
+        return os.path.join(self.checkpoint_dir, f"{user}.json")
+
+    def load_checkpoint(self, user):
+        try:
+            with open(self.checkpoint_path(user)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_checkpoints(self):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        for user, checkpoint in self.checkpoints.items():
+            path = self.checkpoint_path(user)
+            with open(path + ".tmp", "w") as f:
+                json.dump(checkpoint, f)
+            os.replace(path + ".tmp", path)
+
+    def load_scraped(self, user_id):
+        cur = self.storage.execute(
+            "select distinct race_id from keystrokes where user_id = %s",
+            [user_id],
+        )
+        return {race_id for race_id, in cur.fetchall()}
+
+    def scrape_concurrent(self, user, user_id, population):
+        fetch = lambda race_id: self.fetch_race(user, race_id)
+        for i, (race_id, html) in enumerate(bounded_map(fetch, population, self.workers)):
             print(i, race_id)
-            self.fetch_user_data(user, user_id, race_id)
+            self.load_race(user, user_id, race_id, html)
 
     def get_max_race(self, user):
-        soup = self.bsoup(f'profile?user={user}')
+        soup = self.bsoup(f'profile?user={user}', fresh=True)
+        if soup is None:
+            raise KeyError(f"profile of {user} is not cached")
         table = soup.find("table", {"class": "scoresTable"})
         return int(table.find(href=True).text)
 
-    def parse_token(self, token):
-        if len(token) == 0:
-            return []
-        delim = re.search('[^\d]', token)
-        if delim is None:
-            return []
-        i = delim.start()
-        ch_idx = int(token[:i])
-        end = i + 1
-        if end == len(token):
-            return []
-        end = end + 1 if token[end] == '\\' else end 
-        ch = token[end]
-        if token[i] == '+' or token[i] == '$':
-            typed = True 
-        elif token[i] == '-':
-            typed = False
-        else:
-            print("Encountered strange character. Please investigate")
-            return self.parse_token(token[end + 1:])
-        return [[ch, ch_idx, typed]] + self.parse_token(token[end + 1:])
+    def fetch_race(self, user, race_id):
+        query = f'result?id=|tr:{user}|{race_id}'
+        print(self.base + query)
+        try:
+            return self.http.get(self.base + query)
+        except requests.RequestException as e:
+            print(f"failed to fetch {user}|{race_id}: {e}")
+            return None
 
     def fetch_user_data(self, user, user_id, race_id):
-        self.cur.execute(
-            "select exists(select 1 from keystrokes where user_id = %s and race_id = %s)",
-            [user_id, race_id],
-        )
-        exists = self.cur.fetchone()
-        if exists and exists[0]:
+        if race_id in self.scraped[user_id]:
+            return
+        html = self.fetch_race(user, race_id)
+        self.load_race(user, user_id, race_id, html)
+
+    def load_race(self, user, user_id, race_id, html):
+        if html is None:
             return
-        soup = self.bsoup(f'result?id=|tr:{user}|{race_id}')
-        var_pattern = re.compile('var typingLog = ')
-        data_pattern = re.compile(r'(?<=").*(?=,";)')
-        script = soup.find("script", text=var_pattern)
-        if not script:
+        race, action_df = build_race(self.extractor, user_id, race_id, html)
+        self.store_race(user, user_id, race_id, race, action_df)
+
+    def store_race(self, user, user_id, race_id, race, action_df):
+        if not race:
             print(f"failed to fetch data for {user}|{race_id}")
-            return 
-        raw_text = soup.find_all("div", {"class": "fullTextStr"})[0].text
-        print(raw_text)
-        text_info = soup.find_all(href=re.compile('text_info'))[-1]
-        text_id = int(text_info.get("href").split("=")[-1])
-        self.load_text(text_id, raw_text)
-        race_date = parser.parse(
-            soup
-            .find("table", {"class": "raceDetails"})
-            .find(text=re.compile("Date"))
-            .parent.nextSibling.next_sibling.text
-            .strip()
-        )
-        data = str(re.findall(data_pattern, script.text)[0])
-        data = re.split(r'(?<!\d[\+\-\$])\|', data)[-1]
-        data = re.split(r'(?<!\d[\+\-\$]),', data)
-        print(data)
-        queue = deque(data)
-        keystrokes = []
-        keystrokes.append([text_id, user_id, race_date, race_id, "", 0, True, -1])
-        while queue:
-            word_idx = int(queue.popleft())
-            length = int(queue.popleft())
-            for i in range(length):
-                ms = int(queue.popleft())
-                token = queue.popleft()
-                stats = self.parse_token(token)
-                ms //= len(stats)
-                for ch, ch_idx, typed in stats:
-                    keystrokes.append(
-                        [text_id, user_id, race_date, race_id, ch, ms, typed, word_idx + ch_idx]
-                    )
-        action_df = pd.DataFrame(
-            keystrokes,
-            columns=[
-                'text_id',
-                'user_id',
-                'race_date',
-                'race_id',
-                'ch',
-                'ms',
-                'forward',
-                'ch_index',
-            ],
-        ).reset_index()
-        action_df = action_df.rename(columns={"index": "seq_index"})
-        key = ['text_id', 'user_id', 'race_date', 'race_id']
-        action_df = action_df.merge(action_df, on=key, suffixes=["", "_prev"])
-        action_df = action_df[action_df.seq_index - action_df.seq_index_prev == 1]
-        action_df = action_df[
-            [*key, "ch_prev", "ch", "ms", "forward_prev", "forward", "ch_index", "seq_index"]
-        ]
-        self.cur.execute(
-            "select exists(select 1 from keystrokes where user_id = %s and text_id = %s and race_id = %s)",
-            [user_id, text_id, race_id],
-        )
-        exists = self.cur.fetchone()
-        if exists and not exists[0]:
-            print("Writing to DB", "\n")
-            df_to_postgres(action_df, "keystrokes", self.conn)
+            self.checkpoints[user]["skipped"].append(race_id)
+            return
+        print(race.raw_text)
+        self.load_text(race.text_id, race.raw_text)
+        if race_id not in self.scraped[user_id]:
+            self.scraped[user_id].add(race_id)
+            if self.reingest:
+                self.reingested.append((user, race_id))
+            self.writer.add_keystrokes(action_df)
 
 
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("username")
+    arg_parser.add_argument("--workers", type=int, default=1, help="concurrent race fetches")
+    add_scraper_arguments(arg_parser)
+    arg_parser.add_argument("--batch-rows", type=int, default=100000, help="keystrokes buffered per COPY")
+    arg_parser.add_argument("--batch-seconds", type=float, default=60, help="max seconds between flushes")
+    arg_parser.add_argument("--checkpoint-dir", default=".checkpoints", help="where interrupted scrapes are resumed from")
+    add_reingest_argument(arg_parser)
     args = arg_parser.parse_args()
-    ts = TypeScraper()
+    if args.reingest and not args.replay:
+        arg_parser.error("--reingest needs --replay")
+    ts = TypeScraper(
+        workers=args.workers,
+        batch_rows=args.batch_rows,
+        batch_seconds=args.batch_seconds,
+        checkpoint_dir=args.checkpoint_dir,
+        reingest=args.reingest,
+        **scraper_kwargs(args),
+    )
     ts.scrape(args.username)
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+
+def bigram_stats(storage, user_id, by_day=False, forward_only=True, start=None, end=None):
+    """
+    Latency statistics per (ch_prev, ch) for one user, read from the
+    bigram_stats aggregates instead of keystrokes. by_day splits them per
+    day; with forward_only (the default) only transitions between two
+    correct keystrokes are counted, otherwise the forward flags are kept as
+    columns. start and end bound the days included (end is exclusive).
+    Returns count, sum, mean, std (sample), min and max of ms.
+    """
+    keys = (["day"] if by_day else []) + ["ch_prev", "ch"]
+    if not forward_only:
+        keys += ["forward_prev", "forward"]
+    where = ["user_id = %s"]
+    params = [user_id]
+    if forward_only:
+        where.append("forward and forward_prev")
+    if start is not None:
+        where.append("day >= %s")
+        params.append(start)
+    if end is not None:
+        where.append("day < %s")
+        params.append(end)
+    df = storage.read_sql(
+        f"""
+            select {", ".join(keys)}, sum(n) as count, sum(ms_sum) as sum, sum(ms_sq) as sq,
+                   min(ms_min) as min, max(ms_max) as max
+            from bigram_stats
+            where {" and ".join(where)}
+            group by {", ".join(keys)}
+        """,
+        params=params,
+    )
+    if by_day:
+        df["day"] = pd.to_datetime(df["day"])
+    count = df["count"].astype(float)
+    df["mean"] = df["sum"] / count
+    variance = (df["sq"] - df["sum"].astype(float) ** 2 / count) / (count - 1)
+    df["std"] = np.sqrt(variance.clip(lower=0).where(count > 1))
+    return df[keys + ["count", "sum", "mean", "std", "min", "max"]]
+
+
+class StreamingStats:
+    """
+    Group-by statistics over a stream of DataFrame chunks. Keeps only the
+    count of every distinct (keys..., value), so memory is bounded by the
+    number of distinct values per group rather than the number of rows,
+    and quantiles come out exact (pandas' linear interpolation).
+    """
+
+    def __init__(self, keys, value):
+        self.keys = list(keys)
+        self.value = value
+        self.counts = None
+
+    def update(self, df):
+        counts = df.groupby(self.keys + [self.value], observed=True, dropna=False).size()
+        self.counts = counts if self.counts is None else self.counts.add(counts, fill_value=0)
+
+    def frame(self):
+        if self.counts is None:
+            return pd.DataFrame(columns=self.keys + [self.value, "n"])
+        return self.counts.astype("int64").rename("n").reset_index()
+
+    def quantile(self, q, by=None):
+        """
+        Returns the q-th quantile of the value over everything seen, or per
+        group of the keys in by.
+        """
+        df = self.frame()
+        if not by:
+            return counts_quantile(df[self.value], df["n"], q)
+        totals = df.groupby(by + [self.value])["n"].sum().reset_index()
+        return totals.groupby(by).apply(
+            lambda g: counts_quantile(g[self.value], g["n"], q), include_groups=False
+        ).rename(self.value)
+
+    def stats(self, lower=None, upper=None):
+        """
+        Returns count, sum, mean, std (sample), min and max of the value per
+        group, counting only values in [lower, upper) when bounds are given.
+        """
+        df = self.frame()
+        if lower is not None:
+            df = df[df[self.value] >= lower]
+        if upper is not None:
+            df = df[df[self.value] < upper]
+        return weighted_stats(df, self.keys, self.value)
+
+
+def weighted_stats(df, keys, value, weight="n"):
+    """
+    count, sum, mean, std (sample), min and max of value per group of keys
+    in a frame of counts, where each row stands for weight rows with that
+    value (as StreamingStats.frame() returns).
+    """
+    values = df[value].astype(float)
+    df = df.assign(sum=values * df[weight], sq=values ** 2 * df[weight])
+    grouped = df.groupby(keys, dropna=False)
+    result = grouped[[weight, "sum", "sq"]].sum().rename(columns={weight: "count"})
+    result["min"] = grouped[value].min()
+    result["max"] = grouped[value].max()
+    count = result["count"].astype(float)
+    result["mean"] = result["sum"] / count
+    variance = (result["sq"] - result["sum"] ** 2 / count) / (count - 1)
+    result["std"] = np.sqrt(variance.clip(lower=0).where(count > 1))
+    return result[["count", "sum", "mean", "std", "min", "max"]].reset_index()
+
+
+def counts_quantile(values, counts, q):
+    order = np.argsort(values.to_numpy())
+    values = values.to_numpy()[order].astype(float)
+    cumulative = np.cumsum(counts.to_numpy()[order])
+    if not len(values):
+        return np.nan
+    position = (cumulative[-1] - 1) * q
+    lo, hi = np.searchsorted(cumulative, [np.floor(position), np.ceil(position)], side="right")
+    return values[lo] + (position - np.floor(position)) * (values[hi] - values[lo])
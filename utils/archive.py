@@ -0,0 +1,204 @@
+import os
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from utils.storage import get_storage
+
+# Fixed-width columns, stored as raw little-endian arrays of these dtypes.
+COLUMN_DTYPES = {
+    'text_id': '<i4',
+    'user_id': '<i4',
+    'race_id': '<i4',
+    'race_date': '<M8[s]',
+    'ch_prev': '<u2',
+    'ch': '<u2',
+    'ms': '<i4',
+    'ch_index': '<i4',
+    'seq_index': '<i4',
+}
+# Boolean columns, bit-packed eight rows to a byte.
+FLAG_COLUMNS = ['forward_prev', 'forward']
+CHAR_COLUMNS = ['ch_prev', 'ch']
+COLUMNS = [
+    'text_id', 'user_id', 'race_date', 'race_id', 'ch_prev', 'ch',
+    'ms', 'forward_prev', 'forward', 'ch_index', 'seq_index',
+]
+INDEX_DTYPES = {
+    'race_user': '<i4',
+    'race_ids': '<i4',
+    'race_offsets': '<i8',
+    'user_ids': '<i4',
+    'user_offsets': '<i8',
+}
+
+
+class ArchiveWriter:
+    """
+    Appends keystrokes to a columnar archive one user at a time. Rows must
+    arrive grouped by user in ascending user_id order and sorted by
+    (race_id, seq_index) within each user. Characters are stored as codes
+    into a shared alphabet, with 0 meaning NULL.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.files = {
+            col: open(self.file(col), 'wb') for col in list(COLUMN_DTYPES) + FLAG_COLUMNS
+        }
+        self.alphabet = {}
+        self.rows = 0
+        self.races = []
+        self.users = []
+
+    def file(self, col):
+        return os.path.join(self.path, f'{col}.bin')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def codes(self, chars):
+        for ch in pd.unique(chars.dropna()):
+            if ch and ch not in self.alphabet:
+                self.alphabet[ch] = len(self.alphabet) + 1
+        return chars.map(self.alphabet).fillna(0).to_numpy(COLUMN_DTYPES['ch'])
+
+    def add(self, df):
+        if not len(df):
+            return
+        user_id = int(df.user_id.iloc[0])
+        if self.users and user_id <= self.users[-1][0]:
+            raise ValueError(f"user {user_id} is out of order")
+        for col, dtype in COLUMN_DTYPES.items():
+            values = self.codes(df[col]) if col in CHAR_COLUMNS else df[col].to_numpy(dtype)
+            self.files[col].write(values.tobytes())
+        for col in FLAG_COLUMNS:
+            # Unpacked for now, packed in close() once the row count is known.
+            self.files[col].write(df[col].fillna(False).to_numpy(np.bool_).tobytes())
+        race_ids = df.race_id.to_numpy()
+        starts = np.flatnonzero(np.r_[True, race_ids[1:] != race_ids[:-1]])
+        self.users.append((user_id, len(self.races)))
+        self.races.extend(zip([user_id] * len(starts), race_ids[starts], starts + self.rows))
+        self.rows += len(df)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        for col in FLAG_COLUMNS:
+            flags = np.fromfile(self.file(col), dtype=np.bool_)
+            np.packbits(flags).tofile(self.file(col))
+        races = np.array(self.races, dtype=np.int64).reshape(-1, 3)
+        users = np.array(self.users, dtype=np.int64).reshape(-1, 2)
+        index = {
+            'race_user': races[:, 0],
+            'race_ids': races[:, 1],
+            'race_offsets': np.r_[races[:, 2], self.rows],
+            'user_ids': users[:, 0],
+            'user_offsets': np.r_[users[:, 1], len(races)],
+        }
+        for name, values in index.items():
+            values.astype(INDEX_DTYPES[name]).tofile(self.file(name))
+        alphabet = sorted(self.alphabet, key=self.alphabet.get)
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'rows': self.rows, 'races': len(races), 'alphabet': alphabet}, f)
+
+
+class KeystrokeArchive:
+    """
+    Read side of an archive. Every column is a read-only np.memmap over its
+    file, so opening an archive reads nothing but the metadata and slices
+    only page in the rows they touch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.rows = meta['rows']
+        self.alphabet = np.array([None] + meta['alphabet'], dtype=object)
+        self.columns = {col: self.map(col, dtype) for col, dtype in COLUMN_DTYPES.items()}
+        self.flags = {col: self.map(col, np.uint8) for col in FLAG_COLUMNS}
+        for name, dtype in INDEX_DTYPES.items():
+            setattr(self, name, self.map(name, dtype))
+
+    def map(self, name, dtype):
+        file = os.path.join(self.path, f'{name}.bin')
+        if not os.path.getsize(file):
+            return np.empty(0, dtype=dtype)
+        return np.memmap(file, dtype=dtype, mode='r')
+
+    def __len__(self):
+        return self.rows
+
+    def user_rows(self, user_id):
+        """Returns the (start, stop) row range of a user's keystrokes."""
+        i = np.searchsorted(self.user_ids, user_id)
+        if i == len(self.user_ids) or self.user_ids[i] != user_id:
+            return 0, 0
+        first, last = self.user_offsets[i], self.user_offsets[i + 1]
+        return int(self.race_offsets[first]), int(self.race_offsets[last])
+
+    def race_rows(self, user_id, race_id):
+        first, last = np.searchsorted(self.race_user, [user_id, user_id + 1])
+        i = first + np.searchsorted(self.race_ids[first:last], race_id)
+        if i == last or self.race_ids[i] != race_id:
+            return 0, 0
+        return int(self.race_offsets[i]), int(self.race_offsets[i + 1])
+
+    def column(self, col, start=0, stop=None):
+        stop = self.rows if stop is None else stop
+        if col in FLAG_COLUMNS:
+            packed = self.flags[col][start // 8:(stop + 7) // 8]
+            bits = np.unpackbits(packed, count=stop - start // 8 * 8)
+            return bits[start % 8:].view(np.bool_)
+        return self.columns[col][start:stop]
+
+    def chars(self, codes):
+        return self.alphabet[codes]
+
+    def frame(self, user_id=None, columns=COLUMNS, decode=True):
+        """
+        Returns keystrokes (all of them, or one user's) as a DataFrame in the
+        keystrokes table layout. Characters are decoded to categoricals
+        unless decode is False, in which case their integer codes are kept.
+        """
+        start, stop = self.user_rows(user_id) if user_id is not None else (0, self.rows)
+        data = {}
+        for col in columns:
+            values = self.column(col, start, stop)
+            if col in CHAR_COLUMNS and decode:
+                values = pd.Categorical.from_codes(
+                    values.astype(np.int32) - 1, categories=self.alphabet[1:]
+                )
+            data[col] = values
+        return pd.DataFrame(data, copy=False)
+
+
+def build_archive(storage, path, users=None):
+    if users is None:
+        users = storage.read_sql("select distinct user_id from keystrokes").user_id.tolist()
+    with ArchiveWriter(path) as writer:
+        for user_id in sorted(users):
+            df = storage.read_sql(
+                f"select {', '.join(COLUMNS)} from keystrokes where user_id = %s order by race_id, seq_index",
+                [int(user_id)],
+            )
+            print(f"Archiving {len(df)} keystrokes for user {user_id}")
+            writer.add(df)
+    return writer.rows
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("path", help="directory to write the archive to")
+    arg_parser.add_argument("--users", type=int, nargs="*", default=None, help="user ids, default all")
+    arg_parser.add_argument("--db", default=None, help="sqlite:///path.db for a local file, default $TYPESCRAPER_DB or postgres")
+    args = arg_parser.parse_args()
+    rows = build_archive(get_storage(args.db), args.path, users=args.users)
+    print(f"Archived {rows} keystrokes to {args.path}")
@@ -0,0 +1,134 @@
+import os
+import hashlib
+import pickle
+import threading
+import zlib
+
+
+class DiskCache:
+    """
+    On-disk key/value store of bytes. Entries are stored under the sha256
+    of their key and evicted least-recently-used first once the cache grows
+    past max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3, suffix=".bin"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.lock = threading.Lock()
+        self.sizes = {}
+        os.makedirs(path, exist_ok=True)
+        for root, _, files in os.walk(path):
+            for name in files:
+                if name.endswith(suffix):
+                    file = os.path.join(root, name)
+                    self.sizes[file] = os.path.getsize(file)
+        self.total = sum(self.sizes.values())
+
+    def file(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest + self.suffix)
+
+    def get_bytes(self, key):
+        file = self.file(key)
+        try:
+            with open(file, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(file)
+        return data
+
+    def put_bytes(self, key, data):
+        file = self.file(key)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, file)
+        with self.lock:
+            self.total += len(data) - self.sizes.get(file, 0)
+            self.sizes[file] = len(data)
+            if self.total > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        target = self.max_bytes * 0.9
+        files = sorted(self.sizes, key=lambda f: os.stat(f).st_mtime)
+        for file in files:
+            if self.total <= target:
+                break
+            os.remove(file)
+            self.total -= self.sizes.pop(file)
+
+
+class PageCache(DiskCache):
+    """
+    Compressed cache of raw response bodies, keyed by URL.
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3):
+        super().__init__(path, max_bytes=max_bytes, suffix=".z")
+
+    def get(self, url):
+        data = self.get_bytes(url)
+        if data is None:
+            return None
+        return zlib.decompress(data).decode("utf-8")
+
+    def put(self, url, text):
+        self.put_bytes(url, zlib.compress(text.encode("utf-8")))
+
+
+class QueryCache:
+    """
+    Memoizes analytics reads on local disk. Every entry is keyed by its
+    query, params and an ingest watermark (the ingest versions the storage
+    bumps on every write, and row counts, for one user when user is given,
+    else for everyone), so results refresh on their own as soon as races
+    or WPM rows are written or re-ingested. Reads of small tables that are
+    edited in place (users, layouts) name them in tables and are also keyed
+    on a digest of their contents. Pass refresh=True to bypass the cache.
+    """
+
+    USER_WATERMARK = """
+        select (select version from ingest_versions where user_id = %s),
+               (select count(*) from race_summary where user_id = %s),
+               (select count(*) from wpm where user_id = %s)
+    """
+    WATERMARK = """
+        select (select sum(version) from ingest_versions),
+               (select count(*) from race_summary),
+               (select count(*) from wpm)
+    """
+
+    def __init__(self, storage, path=".cache/queries", max_bytes=1024 ** 3):
+        self.storage = storage
+        self.cache = DiskCache(path, max_bytes=max_bytes, suffix=".pkl")
+
+    def watermark(self, user=None, tables=()):
+        if user is None:
+            mark = tuple(self.storage.execute(self.WATERMARK).fetchone())
+        else:
+            mark = tuple(self.storage.execute(self.USER_WATERMARK, [user] * 3).fetchone())
+        return mark + tuple(self.digest(table) for table in tables)
+
+    def digest(self, table):
+        rows = self.storage.execute(f"select * from {table}").fetchall()
+        return hashlib.sha256(repr(sorted(map(repr, rows))).encode("utf-8")).hexdigest()
+
+    def cached(self, name, params, compute, user=None, tables=(), refresh=False):
+        """Returns compute(), reusing a stored result for the same inputs."""
+        key = repr((name, params, user, self.watermark(user, tables)))
+        if not refresh:
+            data = self.cache.get_bytes(key)
+            if data is not None:
+                return pickle.loads(data)
+        result = compute()
+        self.cache.put_bytes(key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        return result
+
+    def read_sql(self, query, params=None, user=None, tables=(), refresh=False):
+        compute = lambda: self.storage.read_sql(query, params=params)
+        return self.cached(query, params, compute, user=user, tables=tables, refresh=refresh)
@@ -1,15 +1,261 @@
 import io
+import struct
+import time
+from datetime import datetime, timedelta
 
-def df_to_postgres(df, table, conn):
-    cur = conn.cursor()
-    output = io.StringIO()
-    df.to_csv(output, sep='`', header=False, index=False, doublequote=False, escapechar='\\')
+import pandas as pd
+from psycopg2 import sql
+
+PG_EPOCH = datetime(2000, 1, 1)
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+COPY_TRAILER = struct.pack('!h', -1)
+NULL = struct.pack('!i', -1)
+
+KEYSTROKE_TYPES = [
+    'int4', 'int4', 'timestamp', 'int4', 'char', 'char', 'int4', 'bool', 'bool', 'int4', 'int4'
+]
+TEXT_TYPES = ['int4', 'text']
+TABLE_TYPES = {'keystrokes': KEYSTROKE_TYPES, 'texts': TEXT_TYPES}
+
+LAYOUT_KEY = ['row', 'col', 'shifted']
+# Schema of a layout table like qwerty, for layouts KeyboardLoader loads
+# into a table that doesn't exist yet. LAYOUT_KEY is the upsert key.
+LAYOUT_SCHEMA = """
+    create table if not exists {} (
+        ch character(1),
+        hand character(1),
+        digit integer,
+        shifted boolean,
+        "row" integer,
+        col integer,
+        unique ("row", col, shifted)
+    )
+"""
+CONFLICT_KEYS = {
+    'keystrokes': ['user_id', 'text_id', 'race_id', 'seq_index'],
+    'texts': ['text_id'],
+    'wpm': ['user_id', 'race_date', 'race_id'],
+    'qwerty': LAYOUT_KEY,
+    'dvorak': LAYOUT_KEY,
+    'colemak': LAYOUT_KEY,
+}
+
+# Summary tables kept up to date by every merge into the table they
+# summarise, in the same statement. Each reads the newly inserted rows from
+# the "merged" CTE, so skipped duplicates are never counted twice.
+AGGREGATES = {
+    'keystrokes': {
+        'bigram_stats': """
+            insert into bigram_stats
+            select user_id, race_date::date, ch_prev, ch, forward_prev, forward,
+                   count(ms), coalesce(sum(ms), 0), coalesce(sum(ms::bigint * ms), 0), min(ms), max(ms)
+            from merged
+            where ch_prev is not null and ch is not null
+            group by 1, 2, 3, 4, 5, 6
+            on conflict (user_id, day, ch_prev, ch, forward_prev, forward) do update set
+                n = bigram_stats.n + excluded.n,
+                ms_sum = bigram_stats.ms_sum + excluded.ms_sum,
+                ms_sq = bigram_stats.ms_sq + excluded.ms_sq,
+                ms_min = least(bigram_stats.ms_min, excluded.ms_min),
+                ms_max = greatest(bigram_stats.ms_max, excluded.ms_max)
+        """,
+        'race_summary': """
+            insert into race_summary
+            select m.user_id, m.race_id, m.text_id, min(m.race_date), count(*), coalesce(sum(m.ms), 0),
+                   sum(case when m.forward then 0 else 1 end),
+                   cast(sum(case when m.forward then 0 else m.ms end) as float) / nullif(sum(m.ms), 0),
+                   avg(case when m.forward and m.forward_prev and m.seq_index > 1 then m.ms end),
+                   max(length(t.raw_text))
+            from merged m join texts t on t.text_id = m.text_id
+            group by m.user_id, m.race_id, m.text_id
+            on conflict (user_id, race_id) do nothing
+        """,
+    },
+}
+
+
+def copy_upsert(cur, df, table, update=False, key=None, types=None):
+    """
+    COPYs df into a temporary staging table and merges it into table with
+    INSERT ... ON CONFLICT, so duplicate rows are skipped (or, with update,
+    overwrite the existing row) instead of failing the whole batch. Uses a
+    binary COPY when the column types are given. Inserted rows are also
+    folded into the table's AGGREGATES. Does not commit; returns
+    (inserted, updated, skipped) row counts.
+    """
+    key = key or CONFLICT_KEYS[table]
+    staging = sql.Identifier(f"staging_{table}")
+    target = sql.Identifier(table)
+    columns = sql.SQL(", ").join(map(sql.Identifier, key))
+    cur.execute(
+        sql.SQL("create temp table {} (like {} including defaults) on commit drop").format(
+            staging, target
+        )
+    )
+    if types:
+        copy = sql.SQL("copy {} from stdin with (format binary)").format(staging)
+        cur.copy_expert(copy.as_string(cur), to_copy_binary(df, types))
+    else:
+        output = io.StringIO()
+        df.to_csv(output, sep='`', header=False, index=False, doublequote=False, escapechar='\\')
+        output.seek(0)
+        cur.copy_from(output, f"staging_{table}", sep='`', null="")
+    existing = 0
+    if update:
+        # Counted up front: xmax cannot be returned from partitioned tables.
+        cur.execute(
+            sql.SQL("select count(*) from {} where ({}) in (select {} from {})").format(
+                target, columns, columns, staging
+            )
+        )
+        existing = cur.fetchone()[0]
+        cur.execute(sql.SQL("select * from {} limit 0").format(target))
+        assignments = sql.SQL(", ").join(
+            sql.SQL("{0} = excluded.{0}").format(sql.Identifier(col.name))
+            for col in cur.description if col.name not in key
+        )
+        action = sql.SQL("do update set {}").format(assignments)
+    else:
+        action = sql.SQL("do nothing")
+    if table in AGGREGATES and not update:
+        returning = sql.SQL("*")
+        aggregate = sql.SQL("").join(
+            sql.SQL(", {} as ({})").format(sql.Identifier(f"update_{name}"), sql.SQL(query))
+            for name, query in AGGREGATES[table].items()
+        )
+    else:
+        returning = sql.SQL("1")
+        aggregate = sql.SQL("")
+    cur.execute(
+        sql.SQL("""
+            with merged as (
+                insert into {target}
+                select distinct on ({columns}) * from {staging}
+                on conflict ({columns}) {action}
+                returning {returning}
+            ){aggregate}
+            select count(*) from merged
+        """).format(
+            target=target, staging=staging, columns=columns, action=action,
+            returning=returning, aggregate=aggregate,
+        )
+    )
+    merged = cur.fetchone()[0]
+    cur.execute(sql.SQL("drop table {}").format(staging))
+    return merged - existing, existing, len(df) - merged
+
+
+def encode_int4(value):
+    return struct.pack('!ii', 4, value)
+
+
+def encode_bool(value):
+    return struct.pack('!i?', 1, value)
+
+
+def encode_timestamp(value):
+    return struct.pack('!iq', 8, (value - PG_EPOCH) // timedelta(microseconds=1))
+
+
+def encode_text(value):
+    data = value.encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+
+def encode_char(value):
+    # Matches copy_from(null=""): empty strings are stored as NULL.
+    if not value:
+        return NULL
+    return encode_text(value)
+
+
+ENCODERS = {
+    'int4': encode_int4,
+    'bool': encode_bool,
+    'timestamp': encode_timestamp,
+    'char': encode_char,
+    'text': encode_text,
+}
+
+
+def to_copy_binary(df, types):
+    encoders = [ENCODERS[t] for t in types]
+    count = struct.pack('!h', len(encoders))
+    output = io.BytesIO()
+    output.write(COPY_HEADER)
+    for row in df.itertuples(index=False, name=None):
+        output.write(count)
+        for encode, value in zip(encoders, row):
+            output.write(NULL if value is None else encode(value))
+    output.write(COPY_TRAILER)
     output.seek(0)
-    try:
-        cur.copy_from(output, table, sep='`', null="")
-        conn.commit()
-    except Exception as e:
-        print("Encountered error during write", e)
-        print("Rolling back.")
-        conn.rollback() 
+    return output
+
+
+class BatchWriter:
+    """
+    Buffers texts and keystrokes across races and writes them in a single
+    transaction (one binary COPY and merge per table) once max_rows keystrokes
+    are buffered or max_seconds have passed since the last flush. Use it as
+    a context manager so buffered rows are flushed on shutdown or error.
+    on_commit is called after every successful flush and on_rollback after
+    every failed one. With replace, races already in the database are
+    deleted and written again, and texts are overwritten.
+    """
+
+    def __init__(self, storage, max_rows=100000, max_seconds=60, on_commit=None, on_rollback=None, replace=False):
+        self.storage = storage
+        self.replace = replace
+        self.on_commit = on_commit
+        self.on_rollback = on_rollback
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.texts = {}
+        self.frames = []
+        self.rows = 0
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def add_text(self, text_id, raw_text):
+        self.texts.setdefault(text_id, raw_text)
+
+    def add_keystrokes(self, df):
+        self.frames.append(df)
+        self.rows += len(df)
+        if self.rows >= self.max_rows or time.monotonic() - self.last_flush >= self.max_seconds:
+            self.flush()
 
+    def flush(self):
+        if not self.texts and not self.frames:
+            return
+        try:
+            counts = {}
+            if self.texts:
+                texts = pd.DataFrame(list(self.texts.items()), columns=['text_id', 'raw_text'])
+                counts.update(self.storage.write({'texts': texts}, update=self.replace))
+            if self.frames:
+                keystrokes = pd.concat(self.frames)
+                if self.replace:
+                    self.storage.delete_races(keystrokes[['user_id', 'race_id']].drop_duplicates())
+                counts.update(self.storage.write({'keystrokes': keystrokes}))
+            if 'keystrokes' in counts:
+                inserted, _, skipped = counts['keystrokes']
+                print(f"Writing {inserted} keystrokes to DB ({skipped} already present)", "\n")
+            self.storage.commit()
+        except Exception as e:
+            self.storage.rollback_write(e)
+            if self.on_rollback:
+                self.on_rollback()
+        else:
+            if self.on_commit:
+                self.on_commit()
+        finally:
+            self.texts = {}
+            self.frames = []
+            self.rows = 0
+            self.last_flush = time.monotonic()
@@ -0,0 +1,159 @@
+import re
+import html as htmllib
+from collections import namedtuple
+from io import StringIO
+
+import pandas as pd
+from bs4 import BeautifulSoup
+from dateutil import parser
+
+from utils.typinglog import extract_log
+
+LOG_MARKER = 'var typingLog = '
+LOG_PATTERN = re.compile(LOG_MARKER)
+FULL_TEXT_PATTERN = re.compile(
+    r'<div\b[^>]*\bclass="[^"]*\bfullTextStr\b[^"]*"[^>]*>(.*?)</div>', re.DOTALL
+)
+TEXT_INFO_PATTERN = re.compile(r'\bhref="([^"]*text_info[^"]*)"')
+RACE_DETAILS_PATTERN = re.compile(
+    r'<table\b[^>]*\bclass="[^"]*\braceDetails\b[^"]*"[^>]*>(.*?)</table>', re.DOTALL
+)
+DATE_PATTERN = re.compile(
+    r'>([^<]*Date[^<]*)</(\w+)>\s+<(\w+)\b[^>]*>([^<]*)</\3>', re.DOTALL
+)
+SCORES_PATTERN = re.compile(
+    r'<table\b[^>]*\bclass="[^"]*\bscoresTable\b[^"]*"[^>]*>(.*?)</table>', re.DOTALL
+)
+ROW_PATTERN = re.compile(r'<tr\b[^>]*>(.*?)</tr>', re.DOTALL)
+CELL_PATTERN = re.compile(r'<(t[dh])\b[^>]*>(.*?)</\1>', re.DOTALL)
+TAG_PATTERN = re.compile(r'<[^>]*>')
+SPACE_PATTERN = re.compile(r'[\r\n]+|\s{2,}')
+
+RaceData = namedtuple('RaceData', ['text_id', 'raw_text', 'race_date', 'log'])
+
+
+class ExtractionError(ValueError):
+    pass
+
+
+class SoupExtractor:
+
+    def race(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        script = soup.find("script", text=LOG_PATTERN)
+        if not script:
+            return None
+        raw_text = soup.find_all("div", {"class": "fullTextStr"})[0].text
+        text_info = soup.find_all(href=re.compile('text_info'))[-1]
+        text_id = int(text_info.get("href").split("=")[-1])
+        race_date = parser.parse(
+            soup
+            .find("table", {"class": "raceDetails"})
+            .find(text=re.compile("Date"))
+            .parent.nextSibling.next_sibling.text
+            .strip()
+        )
+        return RaceData(text_id, raw_text, race_date, extract_log(script.text))
+
+    def race_date(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        details = soup.find("table", {"class": "raceDetails"})
+        date = details.find(string=re.compile("Date")) if details else None
+        if not date:
+            return None
+        return parser.parse(date.parent.next_sibling.next_sibling.text.strip())
+
+    def history(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        table = soup.find("table", {"class": "scoresTable"})
+        if not table:
+            return None
+        return pd.read_html(StringIO(str(table)))[0]
+
+
+class FastExtractor:
+    """
+    Pulls the fields straight out of the raw HTML with compiled patterns.
+    Raises ExtractionError whenever the markup is not in the exact shape it
+    expects, so it should sit in front of a SoupExtractor.
+    """
+
+    def race(self, html):
+        marker = html.find(LOG_MARKER)
+        if marker < 0:
+            return None
+        start = html.rfind('<script', 0, marker)
+        end = html.find('</script>', marker)
+        if start < 0 or end < 0 or html.find('</script>', start, marker) >= 0:
+            raise ExtractionError("typingLog is not inside a script")
+        log = extract_log(html[html.find('>', start) + 1:end])
+        full_text = FULL_TEXT_PATTERN.search(html)
+        text_info = TEXT_INFO_PATTERN.findall(html)
+        details = RACE_DETAILS_PATTERN.search(html)
+        date = DATE_PATTERN.search(details.group(1)) if details else None
+        if not full_text or '<' in full_text.group(1) or not text_info or not date:
+            raise ExtractionError("race page not in the expected shape")
+        raw_text = htmllib.unescape(full_text.group(1))
+        text_id = int(htmllib.unescape(text_info[-1]).split("=")[-1])
+        race_date = parser.parse(htmllib.unescape(date.group(4)).strip())
+        return RaceData(text_id, raw_text, race_date, log)
+
+    def race_date(self, html):
+        """The date of a race page, whether or not it has a typing log."""
+        details = RACE_DETAILS_PATTERN.search(html)
+        if not details:
+            return None
+        date = DATE_PATTERN.search(details.group(1))
+        if not date:
+            raise ExtractionError("race details have no date")
+        return parser.parse(htmllib.unescape(date.group(4)).strip())
+
+    def history(self, html):
+        table = SCORES_PATTERN.search(html)
+        if not table:
+            return None
+        rows = []
+        for row in ROW_PATTERN.findall(table.group(1)):
+            rows.append([(tag, cell_text(cell)) for tag, cell in CELL_PATTERN.findall(row)])
+        if not rows or any(tag != 'th' for tag, _ in rows[0]):
+            raise ExtractionError("scores table has no header row")
+        columns = [text for _, text in rows[0]]
+        data = [[text for _, text in row] for row in rows[1:]]
+        if any(len(row) != len(columns) for row in data):
+            raise ExtractionError("ragged scores table")
+        return pd.DataFrame(data, columns=columns)
+
+
+class FallbackExtractor:
+
+    def __init__(self, *extractors):
+        self.extractors = extractors
+
+    def race(self, html):
+        return self.first('race', html)
+
+    def race_date(self, html):
+        return self.first('race_date', html)
+
+    def history(self, html):
+        return self.first('history', html)
+
+    def first(self, method, html):
+        for extractor in self.extractors[:-1]:
+            try:
+                return getattr(extractor, method)(html)
+            except Exception:
+                continue
+        return getattr(self.extractors[-1], method)(html)
+
+
+def cell_text(cell):
+    text = htmllib.unescape(TAG_PATTERN.sub('', cell))
+    return SPACE_PATTERN.sub(' ', text).strip()
+
+
+EXTRACTORS = {
+    'auto': lambda: FallbackExtractor(FastExtractor(), SoupExtractor()),
+    'fast': FastExtractor,
+    'soup': SoupExtractor,
+}
@@ -0,0 +1,179 @@
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Requests per second per host when no --rate is given.
+DEFAULT_MAX_RATE = 4.0
+# Longest Retry-After the client will wait for, in seconds.
+MAX_RETRY_AFTER = 120
+
+
+class TokenBucket:
+    """
+    Per-host request budget that adapts to the server: the refill rate is
+    halved (at most once per cooldown) when a request is throttled, fails
+    or takes much longer than usual, and grows additively on every healthy
+    response, up to max_rate.
+    """
+
+    def __init__(self, max_rate=DEFAULT_MAX_RATE, start_rate=2.0, min_rate=0.1, step=0.1, burst=4, cooldown=2.0, slow_factor=4.0):
+        self.max_rate = max_rate
+        self.rate = min(start_rate, max_rate)
+        self.min_rate = min_rate
+        self.step = step
+        self.burst = burst
+        self.cooldown = cooldown
+        self.slow_factor = slow_factor
+        self.tokens = burst
+        self.latency = None
+        self.updated = time.monotonic()
+        self.decreased = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def feedback(self, ok, elapsed=None):
+        with self.lock:
+            slow = False
+            if elapsed is not None:
+                slow = self.latency is not None and elapsed > self.slow_factor * self.latency
+                self.latency = elapsed if self.latency is None else 0.9 * self.latency + 0.1 * elapsed
+            now = time.monotonic()
+            if not ok or slow:
+                if now - self.decreased >= self.cooldown:
+                    self.rate = max(self.min_rate, self.rate / 2)
+                    self.decreased = now
+            else:
+                self.rate = min(self.rate + self.step, self.max_rate)
+
+
+class HttpClient:
+
+    def __init__(self, pool_size=1, rate=None, cache=None, replay=False, timeout=30, retries=5):
+        self.cache = cache
+        self.replay = replay
+        self.timeout = (5, timeout)
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.buckets = defaultdict(lambda: TokenBucket(max_rate=rate or DEFAULT_MAX_RATE))
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        with self.lock:
+            return self.buckets[urlparse(url).netloc]
+
+    def get(self, url, fresh=False):
+        """
+        Returns the body of url, served from the page cache unless fresh is
+        set (for pages that change over time, which are still cached for
+        replay). In replay mode the network is never touched and misses
+        return None.
+        """
+        if self.cache and (self.replay or not fresh):
+            text = self.cache.get(url)
+            if text is not None:
+                return text
+        if self.replay:
+            return None
+        r = self.request(url)
+        if self.cache:
+            self.cache.put(url, r.text)
+        return r.text
+
+    def request(self, url):
+        """
+        GETs url with connect/read timeouts, retrying connection errors,
+        timeouts, 429s and 5xxs with exponential backoff and full jitter
+        (or the server's Retry-After). Other error statuses raise at once.
+        """
+        bucket = self.bucket(url)
+        for attempt in range(self.retries + 1):
+            bucket.acquire()
+            start = time.monotonic()
+            try:
+                r = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                bucket.feedback(False)
+                error = e
+                delay = None
+            else:
+                if r.status_code != 429 and r.status_code < 500:
+                    bucket.feedback(True, time.monotonic() - start)
+                    r.raise_for_status()
+                    return r
+                bucket.feedback(False)
+                error = requests.HTTPError(f"{r.status_code} for {url}", response=r)
+                delay = retry_after(r)
+            if attempt < self.retries:
+                delay = delay if delay is not None else min(60, 2 ** attempt) * random.random()
+                print(f"Retrying {url} in {delay:.1f}s: {error}")
+                time.sleep(delay)
+        raise error
+
+
+def retry_after(response):
+    """
+    Seconds to wait from the response's Retry-After, in either its seconds
+    or HTTP-date form, capped at MAX_RETRY_AFTER. None when it is missing
+    or can't be parsed, so the caller backs off instead.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        delay = (when - datetime.now(timezone.utc)).total_seconds()
+    if not math.isfinite(delay):
+        return None
+    return min(max(delay, 0), MAX_RETRY_AFTER)
+
+
+def bounded_map(fn, items, workers):
+    """
+    Applies fn to every item on a pool of worker threads, yielding
+    (item, result) pairs in completion order. At most 2 * workers calls
+    are in flight at once, so items may be produced lazily (and consumed
+    results released) without queueing the whole population up front.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        items = iter(items)
+        pending = {}
+        while True:
+            for item in items:
+                pending[executor.submit(fn, item)] = item
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
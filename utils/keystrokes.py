@@ -0,0 +1,40 @@
+import pandas as pd
+
+RACE_KEY = ['text_id', 'user_id', 'race_date', 'race_id']
+ACTION_COLUMNS = [*RACE_KEY, 'seq_index', 'ch', 'ms', 'forward', 'ch_index']
+KEYSTROKE_COLUMNS = [
+    *RACE_KEY, 'ch_prev', 'ch', 'ms', 'forward_prev', 'forward', 'ch_index', 'seq_index'
+]
+
+
+def race_keystrokes(text_id, user_id, race_date, race_id, actions):
+    """
+    Builds the keystrokes rows for one race from its parsed (ch, ch_idx,
+    typed, ms) actions. The race starts from an empty sentinel keystroke,
+    so the first real keystroke gets seq_index 1 and ch_prev "".
+    """
+    rows = []
+    ch_prev, forward_prev = "", True
+    for seq_index, (ch, ch_idx, typed, ms) in enumerate(actions, 1):
+        rows.append(
+            (text_id, user_id, race_date, race_id, ch_prev, ch, ms, forward_prev, typed, ch_idx, seq_index)
+        )
+        ch_prev, forward_prev = ch, typed
+    return pd.DataFrame(rows, columns=KEYSTROKE_COLUMNS)
+
+
+def to_bigrams(action_df):
+    """
+    Pairs every keystroke in action_df (ACTION_COLUMNS) with the one before it
+    in the same race, producing rows in the keystrokes table layout. Several
+    races may be stacked, as long as each race is contiguous and ordered by
+    seq_index.
+    """
+    prev = action_df.shift(1)
+    same_race = action_df.seq_index - prev.seq_index == 1
+    for col in RACE_KEY:
+        same_race &= action_df[col] == prev[col]
+    df = action_df[same_race].copy()
+    df['ch_prev'] = prev.ch[same_race]
+    df['forward_prev'] = prev.forward[same_race].astype(bool)
+    return df[KEYSTROKE_COLUMNS]
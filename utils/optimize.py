@@ -0,0 +1,167 @@
+import os
+import time
+import argparse
+
+import numpy as np
+
+from layout import Layout, BASE_DIR
+from utils.cache import QueryCache
+from utils.smoothing import LayoutComparison, user_bigrams
+from utils.storage import get_storage
+
+
+class LayoutOptimizer:
+    """
+    Searches for the assignment of characters to keys that minimises
+    sum(freq[a, b] * cost[key(a), key(b)]) over a user's bigrams (a
+    quadratic assignment problem). freq and cost are indexed by key
+    position on the starting layout, so assignment[p] is the starting
+    position of the character now on key p. Keys in fixed never move.
+
+    Searches with simulated annealing over swaps of two keys, whose cost
+    change is computed in O(n) from the rows and columns of the two keys,
+    then hill-climbs with the change of every swap at once.
+    """
+
+    def __init__(self, freq, cost, fixed=()):
+        self.n = len(freq)
+        self.cost = np.where(np.isnan(cost), np.nanmean(cost), cost)
+        self.flow = np.array(freq, dtype=float)
+        self.free = np.setdiff1d(np.arange(self.n), fixed)
+        self.assignment = np.arange(self.n)
+        self.total = (self.flow * self.cost).sum()
+        self.best = self.total, self.assignment.copy()
+        self.evaluated = 0
+
+    def delta(self, i, j):
+        """Change in total from swapping keys i and j."""
+        f, c = self.flow, self.cost
+        ri, rj = c[i].copy(), c[j].copy()
+        ri[i], ri[j] = c[i, j], c[i, i]
+        rj[i], rj[j] = c[j, j], c[j, i]
+        cols = (f[:, i] - f[:, j]) * (c[:, j] - c[:, i])
+        return f[i] @ (rj - c[i]) + f[j] @ (ri - c[j]) + cols.sum() - cols[i] - cols[j]
+
+    def deltas(self):
+        """delta(i, j) for every pair of keys, inf for pairs that can't swap."""
+        f, c = self.flow, self.cost
+        fd, cd = np.diag(f), np.diag(c)
+        g = f @ c.T
+        rows = g - np.diag(g)[:, None] + (fd[:, None] - f) * (cd - c.T)
+        h = f.T @ c
+        cols = h + h.T - np.diag(h)[:, None] - np.diag(h)
+        cols -= (fd[:, None] - f) * (c - cd[:, None]) + (f.T - fd) * (cd - c.T)
+        result = np.full((self.n, self.n), np.inf)
+        free = np.ix_(self.free, self.free)
+        result[free] = (rows + rows.T + cols)[free]
+        np.fill_diagonal(result, np.inf)
+        self.evaluated += len(self.free) * (len(self.free) - 1) // 2
+        return result
+
+    def swap(self, i, j, delta):
+        self.flow[[i, j]] = self.flow[[j, i]]
+        self.flow[:, [i, j]] = self.flow[:, [j, i]]
+        self.assignment[[i, j]] = self.assignment[[j, i]]
+        self.total += delta
+        if self.total < self.best[0]:
+            self.best = self.total, self.assignment.copy()
+
+    def anneal(self, steps, start=None, end=None, seed=None, chunk=100000):
+        """
+        Simulated annealing over random swaps, cooling geometrically from
+        start to end (by default the mean cost change of a swap, down to a
+        thousandth of it). Leaves the best assignment seen in place.
+        """
+        rng = np.random.default_rng(seed)
+        if start is None:
+            changes = self.deltas()
+            start = np.abs(changes[np.isfinite(changes)]).mean()
+        end = start / 1000 if end is None else end
+        for offset in range(0, steps, chunk):
+            size = min(chunk, steps - offset)
+            temps = start * (end / start) ** ((offset + np.arange(size)) / steps)
+            thresholds = -temps * np.log(rng.random(size))
+            pairs = self.free[rng.integers(len(self.free), size=(size, 2))]
+            for (i, j), threshold in zip(pairs.tolist(), thresholds.tolist()):
+                if i == j:
+                    continue
+                delta = self.delta(i, j)
+                if delta < threshold:
+                    self.swap(i, j, delta)
+            self.evaluated += size
+        self.restore()
+
+    def climb(self):
+        """Applies the best swap until none lowers the total."""
+        while True:
+            changes = self.deltas()
+            i, j = np.unravel_index(np.argmin(changes), changes.shape)
+            if not changes[i, j] < -1e-9 * abs(self.total):
+                return
+            self.swap(i, j, changes[i, j])
+
+    def restore(self):
+        total, assignment = self.best
+        self.flow = self.flow[np.ix_(np.argsort(self.assignment), np.argsort(self.assignment))]
+        self.flow = self.flow[np.ix_(assignment, assignment)]
+        self.total, self.assignment = total, assignment.copy()
+
+
+def remap(layout, keys, assignment):
+    """
+    layout's key map (shifted keys included) with the key at
+    keys[assignment[p]] moved to keys[p], taking the hand and digit of its
+    new position.
+    """
+    keys = keys[["row", "col", "hand", "digit"]]
+    moves = keys.iloc[assignment][["row", "col"]].reset_index(drop=True)
+    moves = moves.join(keys.add_prefix("new_"))
+    key_map = layout.key_map.merge(moves, on=["row", "col"], how="left")
+    for column in ["row", "col", "hand", "digit"]:
+        key_map[column] = key_map[f"new_{column}"].fillna(key_map[column]).astype(layout.key_map[column].dtype)
+    key_map["shifted"] = key_map.shifted.astype(int)
+    return key_map[["ch", "hand", "digit", "shifted", "row", "col"]]
+
+
+def write_layout(key_map, name, config_dir=os.path.join(BASE_DIR, "configs")):
+    """Writes key_map to configs/<name>/<name>.csv, for KeyboardLoader."""
+    path = os.path.join(config_dir, name, f"{name}.csv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    key_map.to_csv(path, index=False)
+    return path
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Searches for the layout with the lowest smoothed bigram latency for a user or a cohort."
+    )
+    arg_parser.add_argument("name", help="name of the new layout, written to configs/<name>/<name>.csv")
+    arg_parser.add_argument("users", type=int, nargs="+", help="user ids, pooled into one cost model")
+    arg_parser.add_argument("--layout", default="qwerty", help="layout the users type on, and the starting point")
+    arg_parser.add_argument("--base", default="qwerty", help="layout whose columns define neighbouring keys")
+    arg_parser.add_argument("--steps", type=int, default=5000000, help="annealing swaps to try")
+    arg_parser.add_argument("--seed", type=int, default=None)
+    arg_parser.add_argument("--db", default=None, help="sqlite:///path.db for a local file, default $TYPESCRAPER_DB or postgres")
+    args = arg_parser.parse_args()
+
+    cache = QueryCache(get_storage(args.db))
+    layout = Layout.from_db(cache, args.layout)
+    comparison = LayoutComparison(layout, Layout.from_db(cache, args.base), [])
+    count = np.zeros((comparison.n, comparison.n))
+    total = np.zeros((comparison.n, comparison.n))
+    for user in args.users:
+        user_count, user_total = comparison.matrices(user_bigrams(cache, user))
+        count += user_count
+        total += user_total
+    fixed = np.flatnonzero(comparison.keys.row == -2)
+    optimizer = LayoutOptimizer(count, comparison.smooth(count, total), fixed=fixed)
+    before = optimizer.total
+
+    start = time.time()
+    optimizer.anneal(args.steps, seed=args.seed)
+    optimizer.climb()
+    elapsed = time.time() - start
+    print(f"Tried {optimizer.evaluated} swaps in {elapsed:.1f}s ({optimizer.evaluated / elapsed * 60:.0f}/min)")
+    print(f"Mean bigram latency: {before / count.sum():.1f}ms on {args.layout}, {optimizer.total / count.sum():.1f}ms optimized")
+    path = write_layout(remap(layout, comparison.keys, optimizer.assignment), args.name)
+    print(f"Wrote {path}")
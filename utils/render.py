@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from keyboard import Keyboard
+
+# Keyboards of each render worker process, by config path.
+WORKER = {}
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_keyboard(config):
+    """This process's Keyboard for config, drawing on an Agg figure it reuses."""
+    if config not in WORKER:
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        WORKER[config] = Keyboard(config, figure=figure)
+    return WORKER[config]
+
+
+def render(job):
+    kb = get_keyboard(job["config"])
+    options = job.get("options", {})
+    if "heatmap" in job:
+        kb.set_heatmap(job["heatmap"])
+        for char, factor in job.get("scale", {}).items():
+            kb.scale(char, factor)
+        kb.show_heatmap(**options)
+    else:
+        kb.fill_colors(job["colors"])
+        kb.make_colormap(**options)
+    os.makedirs(os.path.dirname(os.path.abspath(job["output"])), exist_ok=True)
+    kb.save(job["output"])
+    return job["output"]
+
+
+class Renderer:
+    """
+    Renders keyboard heatmaps and colormaps headlessly on a process pool.
+    A job is a dict with config (a layout's *_config.json), output (the
+    image path), options for show_heatmap/make_colormap (alpha, cmap, ...)
+    and either heatmap ({char: value}, then an optional scale of
+    {char: factor}) or colors ({char: color}). Each worker loads a layout
+    and its background once and reuses one figure for it. Jobs whose
+    inputs hash the same as when their output was last written are
+    skipped; the hashes are kept in manifest.
+    """
+
+    def __init__(self, manifest=".cache/renders.json", processes=None):
+        self.manifest = manifest
+        self.processes = processes
+        self.digests = {}
+        try:
+            with open(manifest) as f:
+                self.hashes = json.load(f)
+        except FileNotFoundError:
+            self.hashes = {}
+
+    def job_hash(self, job):
+        config = job["config"]
+        if config not in self.digests:
+            with open(config) as f:
+                image = os.path.join(os.path.dirname(config), json.load(f)["image"])
+            self.digests[config] = file_digest(config) + file_digest(image)
+        inputs = {key: value for key, value in job.items() if key != "output"}
+        inputs["config"] = self.digests[config]
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=repr).encode("utf-8")).hexdigest()
+
+    def run(self, jobs):
+        """Renders the jobs that changed and returns their outputs."""
+        todo, hashes = [], {}
+        for job in jobs:
+            output = os.path.abspath(job["output"])
+            hashes[output] = self.job_hash(job)
+            if self.hashes.get(output) != hashes[output] or not os.path.exists(output):
+                todo.append(job)
+        if todo:
+            with ProcessPoolExecutor(self.processes) as pool:
+                rendered = list(pool.map(render, todo, chunksize=4))
+        else:
+            rendered = []
+        for output in rendered:
+            output = os.path.abspath(output)
+            self.hashes[output] = hashes[output]
+        self.save()
+        return rendered
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest)), exist_ok=True)
+        tmp = f"{self.manifest}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.hashes, f)
+        os.replace(tmp, self.manifest)
@@ -0,0 +1,239 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from layout import Layout
+from utils.aggregates import StreamingStats
+from utils.cache import QueryCache
+from utils.storage import get_storage
+
+# Per-bigram latency of keystrokes typed correctly the first time: the last
+# attempt at a character, when the number of attempts is odd, between two
+# forward keystrokes.
+USER_BIGRAMS = """
+    select ch_prev, ch, ms from (
+        select ch_prev, ch, ms, forward, forward_prev, seq_index,
+               count(ms) over w as c, max(seq_index) over w as m_i
+        from keystrokes
+        where user_id = %s
+        window w as (partition by race_id, ch_index)
+    ) k
+    where forward and forward_prev and c %% 2 = 1 and seq_index = m_i
+"""
+
+# State of each compare_users worker process.
+WORKER = {}
+
+
+def scored_keys(layout):
+    """
+    The unshifted keys a layout comparison covers (the three letter rows,
+    the space bar and the keys right of the letters), ordered by position.
+    """
+    keys = layout.key_map[~layout.key_map.shifted.astype(bool)]
+    keys = keys[(keys.row < 2) | (keys.col > 10)]
+    return keys.sort_values(["row", "col"]).reset_index(drop=True)
+
+
+def ratio(num, den):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(den > 0, num / den, np.nan)
+
+
+def take(matrix, index, fill=0):
+    """matrix[index][:, index], with fill where index is len(matrix)."""
+    padded = np.pad(matrix, (0, 1), constant_values=fill)
+    return padded[np.ix_(index, index)]
+
+
+def user_bigrams(cache, user):
+    """Count and sum of ms per bigram for one user, below their 99th percentile."""
+
+    def bigram_latency():
+        stats = StreamingStats(["ch_prev", "ch"], "ms")
+        for chunk in cache.storage.read_chunks(USER_BIGRAMS, params=[user]):
+            stats.update(chunk)
+        return stats.stats(upper=stats.quantile(.99))[["ch_prev", "ch", "count", "sum"]]
+
+    return cache.cached(USER_BIGRAMS, [user], bigram_latency, user=user)
+
+
+class SharedArrays:
+    """
+    numpy arrays copied into one block of shared memory. spec is all
+    another process needs to attach() to them, instead of a pickled copy.
+    """
+
+    def __init__(self, arrays):
+        layout, size = {}, 0
+        for name, array in arrays.items():
+            layout[name] = (size, array.dtype.str, array.shape)
+            size += -(-array.nbytes // 64) * 64
+        self.shm = SharedMemory(create=True, size=max(size, 1))
+        for name, array in arrays.items():
+            offset, dtype, shape = layout[name]
+            np.ndarray(shape, dtype, self.shm.buf, offset)[...] = array
+        self.spec = (self.shm.name, layout)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach(spec):
+    name, layout = spec
+    shm = SharedMemory(name=name)
+    arrays = {key: np.ndarray(shape, dtype, shm.buf, offset) for key, (offset, dtype, shape) in layout.items()}
+    return shm, arrays
+
+
+class LayoutComparison:
+    """
+    Scores a user's bigram latencies on their own layout against other
+    layouts. Latencies are held as count and sum matrices over the key
+    positions of the user's layout, and every bigram is smoothed by pooling
+    its reverse, the bigrams whose first or second key is a neighbour on
+    the base layout (same column, at most one row apart, in either
+    direction) and the bigrams with the same hands and row/column offsets.
+    A layout's score for a bigram is the smoothed latency at the positions
+    it would be typed on that layout. The layouts are assumed to put keys
+    at the same positions.
+    """
+
+    def __init__(self, layout, base, remaps):
+        self.keys = scored_keys(layout)
+        n = self.n = len(self.keys)
+        self.positions = np.full(layout.size, n)
+        self.positions[layout.codes(self.keys.ch)] = np.arange(n)
+
+        row, col = self.keys.row.to_numpy(), self.keys.col.to_numpy()
+        self.adjacent = ((col[:, None] == col) & (np.abs(row[:, None] - row) <= 1)).astype(float)
+        self.groups = pd.DataFrame({
+            "hand_prev": np.repeat(self.keys.hand.to_numpy(), n),
+            "hand": np.tile(self.keys.hand.to_numpy(), n),
+            "row_diff": (row - row[:, None]).ravel(),
+            "col_diff": (col - col[:, None]).ravel(),
+        }).groupby(["hand_prev", "hand", "row_diff", "col_diff"]).ngroup().to_numpy()
+
+        # Where the base layout's key at each position sits on this layout;
+        # bigrams of keys the base layout puts on characters this layout
+        # doesn't have can't be smoothed and are left out.
+        self.base = self.locate(self.align_chars(base), self.keys.ch)
+        known = self.base < n
+        pooled = known[:, None] & known
+        self.pooled = take(pooled, self.base, fill=False)
+        self.valid = pooled & self.pooled & (row != -2)[:, None] & (row != -2)
+        self.remaps = np.array([self.locate(self.keys.ch, self.align_chars(remap)) for remap in remaps])
+
+    ARRAYS = ["positions", "adjacent", "groups", "base", "pooled", "valid", "remaps"]
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """A comparison rebuilt from arrays(), e.g. attached from shared memory."""
+        comparison = cls.__new__(cls)
+        comparison.__dict__.update(arrays)
+        comparison.n = len(comparison.valid)
+        return comparison
+
+    def align_chars(self, other):
+        """The characters of other at the positions of this layout's keys."""
+        keys = scored_keys(other)
+        return self.keys[["row", "col"]].merge(keys[["row", "col", "ch"]], how="left").ch
+
+    def locate(self, chars, among):
+        """Position of each of chars in among, n where it's missing."""
+        among = pd.Series(np.arange(len(among)), index=among)
+        among = among[among.index.notna()]
+        return among.reindex(chars).fillna(self.n).to_numpy(dtype=int)
+
+    def position(self, chars):
+        codes = Layout.codes(chars)
+        return self.positions[np.where(codes < len(self.positions), codes, 0)]
+
+    def matrices(self, stats):
+        """Count and sum matrices from per-bigram count and sum columns."""
+        prev, ch = self.position(stats.ch_prev), self.position(stats.ch)
+        keep = (prev < self.n) & (ch < self.n)
+        count = np.zeros((self.n, self.n))
+        total = np.zeros((self.n, self.n))
+        count[prev[keep], ch[keep]] = stats["count"].to_numpy(dtype=float)[keep]
+        total[prev[keep], ch[keep]] = stats["sum"].to_numpy(dtype=float)[keep]
+        return count, total
+
+    def smooth(self, count, total):
+        """Smoothed latency of every bigram, NaN where nothing was pooled."""
+        a = self.adjacent
+        count_b, total_b = take(count, self.base), take(total, self.base)
+        both_c, both_t = count_b + count_b.T, total_b + total_b.T
+
+        # neighbours of the second key, then of the first one
+        mean_n, count_n = ratio(both_t @ a, both_c @ a), count_b @ a
+        mean_p = ratio(a @ (both_t * self.pooled), a @ (both_c * self.pooled))
+        count_p = a @ (count_b * self.pooled)
+        group_c = np.bincount(self.groups, weights=count.ravel())
+        group_t = np.bincount(self.groups, weights=total.ravel())
+        mean_r = ratio(group_t, group_c)[self.groups].reshape(count.shape)
+        count_r = group_c[self.groups].reshape(count.shape)
+
+        num = total + total.T + np.nan_to_num(mean_n) * count_n
+        num += np.nan_to_num(mean_p) * count_p + np.nan_to_num(mean_r) * count_r
+        return ratio(num, count + count.T + count_n + count_p + count_r)
+
+    def compare(self, stats):
+        """
+        For every remapped layout, the user's bigrams (typed at least once)
+        that both layouts can score: their sum, count and mean latency, and
+        the smoothed latency on this layout (score_x) and on the other
+        (score_y).
+        """
+        count, total = self.matrices(stats)
+        smoothed = self.smooth(count, total)
+        mean = np.nan_to_num(ratio(total, count))
+        results = []
+        for remap in self.remaps:
+            rows = self.valid & take(self.valid, remap, fill=False) & (total > 0)
+            results.append({
+                "sum": total[rows],
+                "count": count[rows],
+                "mean": mean[rows],
+                "score_x": smoothed[rows],
+                "score_y": take(smoothed, remap, fill=np.nan)[rows],
+            })
+        return results
+
+
+def init_worker(db, specs):
+    WORKER["cache"] = QueryCache(get_storage(db))
+    WORKER["comparisons"] = {}
+    for name, spec in specs.items():
+        shm, arrays = attach(spec)
+        WORKER.setdefault("shm", []).append(shm)
+        WORKER["comparisons"][name] = LayoutComparison.from_arrays(arrays)
+
+
+def compare_user(name, user):
+    return WORKER["comparisons"][name].compare(user_bigrams(WORKER["cache"], user))
+
+
+def compare_users(comparisons, users, db=None, processes=None):
+    """
+    Runs comparisons[name].compare for every (name, user_id) in users on a
+    process pool and returns the results in the same order. Every worker
+    opens its own storage (db as for get_storage) and maps the comparisons
+    from shared memory.
+    """
+    if not users:
+        return []
+    shared = {name: SharedArrays(comparison.arrays()) for name, comparison in comparisons.items()}
+    specs = {name: arrays.spec for name, arrays in shared.items()}
+    try:
+        with ProcessPoolExecutor(processes, initializer=init_worker, initargs=(db, specs)) as pool:
+            return list(pool.map(compare_user, *zip(*users)))
+    finally:
+        for arrays in shared.values():
+            arrays.close()
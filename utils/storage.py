@@ -0,0 +1,332 @@
+import os
+import re
+import sqlite3
+from itertools import count
+
+import pandas as pd
+import psycopg2
+from psycopg2 import sql
+
+from utils.db import AGGREGATES, CONFLICT_KEYS, LAYOUT_SCHEMA, TABLE_TYPES, copy_upsert
+
+SQLITE_SCHEMA = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "configs", "sqlite", "schema.sql"
+)
+BOOL_COLUMNS = {"forward", "forward_prev", "shifted"}
+DATE_COLUMNS = {"race_date", "day"}
+# Tables whose writes bump the ingest version of the users in them.
+VERSIONED_TABLES = {"keystrokes", "wpm"}
+PARAM_PATTERN = re.compile(r"%([s%])")
+CURSOR_IDS = count()
+
+# SQLite versions of utils.db.AGGREGATES; {rows} is the set of new rows.
+SQLITE_AGGREGATES = {
+    "keystrokes": {
+        "bigram_stats": """
+            insert into bigram_stats
+            select user_id, date(race_date), ch_prev, ch, forward_prev, forward,
+                   count(ms), coalesce(sum(ms), 0), coalesce(sum(ms * ms), 0), min(ms), max(ms)
+            from {rows}
+            where ch_prev is not null and ch is not null
+            group by 1, 2, 3, 4, 5, 6
+            on conflict (user_id, day, ch_prev, ch, forward_prev, forward) do update set
+                n = n + excluded.n,
+                ms_sum = ms_sum + excluded.ms_sum,
+                ms_sq = ms_sq + excluded.ms_sq,
+                ms_min = min(ms_min, excluded.ms_min),
+                ms_max = max(ms_max, excluded.ms_max)
+        """,
+        "race_summary": """
+            insert into race_summary
+            select m.user_id, m.race_id, m.text_id, min(m.race_date), count(*), coalesce(sum(m.ms), 0),
+                   sum(case when m.forward then 0 else 1 end),
+                   cast(sum(case when m.forward then 0 else m.ms end) as float) / nullif(sum(m.ms), 0),
+                   avg(case when m.forward and m.forward_prev and m.seq_index > 1 then m.ms end),
+                   max(length(t.raw_text))
+            from {rows} m join texts t on t.text_id = m.text_id
+            where true
+            group by m.user_id, m.race_id, m.text_id
+            on conflict (user_id, race_id) do nothing
+        """,
+    },
+}
+
+
+class PostgresStorage:
+
+    # The bigram_stats day of a keystroke.
+    DAY = "race_date::date"
+
+    def __init__(self, dsn=None, **kwargs):
+        # Keyword arguments override the dsn in psycopg2, so the typeracer
+        # defaults only apply when no dsn is given.
+        if dsn is None:
+            kwargs = {"dbname": "typeracer", "user": "typescraper", **kwargs}
+        self.conn = psycopg2.connect(dsn, **kwargs)
+
+    def execute(self, query, params=None):
+        cur = self.conn.cursor()
+        cur.execute(query, params)
+        return cur
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def rollback_write(self, error):
+        """Reports a write that failed with error and rolls it back."""
+        print("Encountered error during write", error)
+        print("Rolling back.")
+        self.rollback()
+
+    def read_sql(self, query, params=None):
+        return pd.read_sql(query, self.conn, params=params)
+
+    def read_chunks(self, query, params=None, chunksize=100000, dtypes=None):
+        """
+        Runs query on a server-side cursor and yields its result as
+        DataFrames of at most chunksize rows, cast to dtypes if given, so
+        only one chunk is ever held in memory.
+        """
+        with self.conn.cursor(name=f"chunks_{next(CURSOR_IDS)}") as cur:
+            cur.itersize = chunksize
+            cur.execute(query, params)
+            yield from fetch_chunks(cur, chunksize, self.typed, dtypes)
+
+    def typed(self, df):
+        return df
+
+    def fetch_or_create_user(self, username):
+        user_id = self.execute(
+            "select user_id from users where username=%s", [username]
+        ).fetchone()
+        if not user_id:
+            user_id = self.execute(
+                "insert into users(username) values(%s) returning user_id", [username]
+            ).fetchone()
+            self.commit()
+        return user_id[0]
+
+    def delete_races(self, races):
+        """
+        Deletes the keystrokes and race summaries of every (user_id,
+        race_id) in races and recomputes the bigram_stats of the days they
+        were typed on from the keystrokes left, so the races can be written
+        again. Does not commit.
+        """
+        for user_id, race_ids in races.groupby("user_id").race_id:
+            user_id, race_ids = int(user_id), [int(race_id) for race_id in race_ids.unique()]
+            match = f"user_id = %s and race_id in ({', '.join(['%s'] * len(race_ids))})"
+            days = [day for day, in self.execute(
+                f"select distinct {self.DAY} from keystrokes where {match}", [user_id, *race_ids]
+            ).fetchall()]
+            self.execute(f"delete from keystrokes where {match}", [user_id, *race_ids])
+            self.execute(f"delete from race_summary where {match}", [user_id, *race_ids])
+            if not days:
+                continue
+            in_days = f"in ({', '.join(['%s'] * len(days))})"
+            self.execute(f"delete from bigram_stats where user_id = %s and day {in_days}", [user_id, *days])
+            rows = f"select * from keystrokes where user_id = %s and {self.DAY} {in_days}"
+            self.execute(self.aggregate("bigram_stats", rows), [user_id, *days])
+        self.bump_versions(races.user_id)
+
+    def aggregate(self, name, rows):
+        """The keystrokes aggregate name, computed over the rows query."""
+        return f"with merged as ({rows}) {AGGREGATES['keystrokes'][name]}"
+
+    def create_layout(self, name):
+        """
+        Creates the layout table name if it doesn't exist, so reloading an
+        existing layout needs no CREATE privilege on the schema. Does not
+        commit.
+        """
+        table = sql.Identifier(name)
+        exists, = self.execute("select to_regclass(%s)", [table.as_string(self.conn)]).fetchone()
+        if not exists:
+            self.execute(sql.SQL(LAYOUT_SCHEMA).format(table))
+
+    def bump_versions(self, user_ids):
+        """
+        Increments the ingest version of every user in user_ids, which
+        QueryCache keys its results on. Does not commit.
+        """
+        for user_id in sorted(set(int(user_id) for user_id in user_ids)):
+            self.execute(
+                """
+                    insert into ingest_versions (user_id, version) values (%s, 1)
+                    on conflict (user_id) do update set version = ingest_versions.version + 1
+                """,
+                [user_id],
+            )
+
+    def write(self, frames, update=False, key=None):
+        """
+        Merges every {table: df} in frames inside the current transaction
+        and returns {table: (inserted, updated, skipped)}. Does not commit.
+        """
+        cur = self.conn.cursor()
+        counts = {
+            table: copy_upsert(cur, df, table, update=update, key=key, types=TABLE_TYPES.get(table))
+            for table, df in frames.items()
+        }
+        self.bump_versions(user_ids(frames))
+        return counts
+
+    def upsert(self, df, table, update=False, key=None):
+        try:
+            counts = self.write({table: df}, update=update, key=key)[table]
+            self.commit()
+        except Exception as e:
+            self.rollback_write(e)
+            return None
+        print(f"{table}: {counts[0]} inserted, {counts[1]} updated, {counts[2]} skipped")
+        return counts
+
+
+class SqliteStorage(PostgresStorage):
+    """
+    Embedded single-file backend. Accepts the same %s-style queries as the
+    Postgres backend and restores boolean and timestamp columns on read.
+    """
+
+    DAY = "date(race_date)"
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("pragma journal_mode = wal")
+        self.conn.execute("pragma synchronous = normal")
+        tables = {name for name, in self.conn.execute("select name from sqlite_master")}
+        with open(SQLITE_SCHEMA) as f:
+            self.conn.executescript(f.read())
+        # Backfill aggregates added to the schema after the file was created.
+        for source, aggregates in SQLITE_AGGREGATES.items():
+            for name, query in aggregates.items():
+                if source in tables and name not in tables:
+                    self.conn.execute(query.format(rows=source))
+        self.commit()
+
+    def execute(self, query, params=None):
+        return self.conn.execute(to_qmark(query), params or [])
+
+    def read_sql(self, query, params=None):
+        return self.typed(pd.read_sql(to_qmark(query), self.conn, params=params))
+
+    def read_chunks(self, query, params=None, chunksize=100000, dtypes=None):
+        # SQLite cursors already step through the result lazily.
+        cur = self.execute(query, params)
+        try:
+            yield from fetch_chunks(cur, chunksize, self.typed, dtypes)
+        finally:
+            cur.close()
+
+    def typed(self, df):
+        for col in df.columns:
+            if col in BOOL_COLUMNS:
+                df[col] = df[col].astype("boolean")
+            elif col in DATE_COLUMNS:
+                df[col] = pd.to_datetime(df[col])
+        return df
+
+    def fetch_or_create_user(self, username):
+        user_id = self.execute(
+            "select user_id from users where username=%s", [username]
+        ).fetchone()
+        if not user_id:
+            cur = self.execute("insert into users(username) values(%s)", [username])
+            self.commit()
+            return cur.lastrowid
+        return user_id[0]
+
+    def aggregate(self, name, rows):
+        return SQLITE_AGGREGATES["keystrokes"][name].format(rows=f"({rows})")
+
+    def create_layout(self, name):
+        self.execute(LAYOUT_SCHEMA.format('"' + name.replace('"', '""') + '"'))
+
+    def write(self, frames, update=False, key=None):
+        counts = {
+            table: self.merge(df, table, update=update, key=key or CONFLICT_KEYS[table])
+            for table, df in frames.items()
+        }
+        self.bump_versions(user_ids(frames))
+        return counts
+
+    def merge(self, df, table, update, key):
+        df = df.drop_duplicates(subset=key)
+        for col, dtype in df.dtypes.items():
+            if pd.api.types.is_datetime64_any_dtype(dtype):
+                df = df.assign(**{col: df[col].dt.strftime("%Y-%m-%d %H:%M:%S")})
+        # Empty strings become NULL, as they do through COPY in Postgres.
+        df = df.astype(object).where(df.notna() & (df != ""), None)
+        columns = ", ".join(f'"{col}"' for col in df.columns)
+        keys = ", ".join(f'"{col}"' for col in key)
+        staging = f"staging_{table}"
+        # A rolled back write can leave its staging table behind.
+        self.conn.execute(f'drop table if exists "{staging}"')
+        self.conn.execute(f'create temp table "{staging}" as select {columns} from "{table}" where 0')
+        self.conn.executemany(
+            f'insert into "{staging}" values ({", ".join("?" * len(df.columns))})',
+            df.itertuples(index=False, name=None),
+        )
+        joined = " and ".join(f's."{col}" = t."{col}"' for col in key)
+        existing = 0
+        if table in SQLITE_AGGREGATES and not update:
+            new_rows = f'(select * from "{staging}" s where not exists (select 1 from "{table}" t where {joined}))'
+            for query in SQLITE_AGGREGATES[table].values():
+                self.conn.execute(query.format(rows=new_rows))
+        if update:
+            existing = self.conn.execute(
+                f'select count(*) from "{staging}" s join "{table}" t on {joined}'
+            ).fetchone()[0]
+            assignments = ", ".join(
+                f'"{col}" = excluded."{col}"' for col in df.columns if col not in key
+            )
+            action = f"do update set {assignments}"
+        else:
+            action = "do nothing"
+        before = self.conn.total_changes
+        self.conn.execute(
+            f'insert into "{table}" ({columns}) select {columns} from "{staging}" where true '
+            f'on conflict ({keys}) {action}'
+        )
+        merged = self.conn.total_changes - before
+        self.conn.execute(f'drop table "{staging}"')
+        return merged - existing, existing, len(df) - merged
+
+
+def fetch_chunks(cur, chunksize, typed, dtypes=None):
+    while True:
+        rows = cur.fetchmany(chunksize)
+        if not rows:
+            return
+        df = typed(pd.DataFrame.from_records(rows, columns=[col[0] for col in cur.description]))
+        yield df.astype(dtypes) if dtypes else df
+
+
+def user_ids(frames):
+    """Users written to the VERSIONED_TABLES in frames."""
+    return [
+        user_id
+        for table, df in frames.items() if table in VERSIONED_TABLES
+        for user_id in df.user_id.unique()
+    ]
+
+
+def to_qmark(query):
+    return PARAM_PATTERN.sub(lambda m: "?" if m.group(1) == "s" else "%", query)
+
+
+def get_storage(url=None):
+    """
+    Opens the storage backend named by url (or $TYPESCRAPER_DB):
+    "sqlite:///path/to/file.db" for the embedded backend, anything else
+    (including nothing) for the typeracer Postgres database.
+    """
+    url = url or os.environ.get("TYPESCRAPER_DB", "")
+    if url.startswith("sqlite:///"):
+        return SqliteStorage(url[len("sqlite:///"):])
+    if url:
+        return PostgresStorage(url)
+    return PostgresStorage()
@@ -0,0 +1,60 @@
+import re
+from functools import lru_cache
+
+DATA_PATTERN = re.compile(r'(?<=").*(?=,";)')
+# A '|' or ',' directly after "<index><op>" is the typed character itself,
+# not a separator.
+SECTION_PATTERN = re.compile(r'(?<!\d[\+\-\$])\|')
+FIELD_PATTERN = re.compile(r'(?<!\d[\+\-\$]),')
+ACTION_PATTERN = re.compile(r'(\d+)(\D)\\?(.)', re.DOTALL)
+
+
+def extract_log(script_text):
+    return DATA_PATTERN.findall(script_text)[0]
+
+
+@lru_cache(maxsize=8192)
+def parse_token(token):
+    """
+    Parses one keystroke token, e.g. "0+T1+h" or "3-e", into a tuple of
+    (ch, ch_idx, typed) actions. Actions with an unknown operator are skipped.
+    Tokens repeat heavily within and across races, so results are memoized.
+    """
+    actions = []
+    pos = 0
+    while pos < len(token):
+        match = ACTION_PATTERN.match(token, pos)
+        if not match:
+            break
+        pos = match.end()
+        ch_idx, op, ch = match.groups()
+        if op == '+' or op == '$':
+            actions.append((ch, int(ch_idx), True))
+        elif op == '-':
+            actions.append((ch, int(ch_idx), False))
+        else:
+            print("Encountered strange character. Please investigate")
+    return tuple(actions)
+
+
+def parse_log(data):
+    """
+    Streams (ch, ch_idx, typed, ms) tuples out of a raw typingLog string
+    without recursion or re-slicing tokens. ch_idx is the absolute index into the race text and ms is
+    the token latency split evenly across the actions it contains.
+    """
+    start = 0
+    for sep in SECTION_PATTERN.finditer(data):
+        start = sep.end()
+    fields = iter(FIELD_PATTERN.split(data[start:]))
+    for word_idx in fields:
+        word_idx = int(word_idx)
+        length = int(next(fields))
+        for _ in range(length):
+            ms = int(next(fields))
+            actions = parse_token(next(fields))
+            if not actions:
+                continue
+            ms //= len(actions)
+            for ch, ch_idx, typed in actions:
+                yield ch, word_idx + ch_idx, typed, ms
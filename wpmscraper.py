@@ -1,26 +1,33 @@
 import argparse
-from dateutil import parser
+from datetime import timedelta
 
 import pandas as pd
+import requests
 
-from utils.db import df_to_postgres
-from typescraper import Scraper
+from utils.http import bounded_map
+from typescraper import Scraper, add_scraper_arguments, scraper_kwargs
+
+# Largest page crawl_window asks for when a day has more races than fit on
+# one page.
+MAX_HISTORY_PAGE = 1000
 
 
 class WPMScraper(Scraper):
 
-    def load_next_date(self, user, user_id, date=None, n=100):
+    def fetch_history(self, user, user_id, date=None, n=100):
         query_list = []
         query_list.append(f"user={user}")
         query_list.append(f"n={n}")
         if date:
             query_list.append(f"startDate={date}")
         query = "&".join(query_list)
-        soup = self.bsoup(f'race_history?{query}')
-        table = soup.find("table", {"class": "scoresTable"})
-        if not table:
-            return False, None
-        df = pd.read_html(str(table))[0]
+        print(self.base + f'race_history?{query}')
+        html = self.http.get(self.base + f'race_history?{query}', fresh=True)
+        if html is None:
+            return None
+        df = self.extractor.history(html)
+        if df is None:
+            return None
         df.Date = pd.to_datetime(df.Date)
         df.Speed = df.Speed.str.split(' ').str[0].astype(int)
         df.Accuracy = df.Accuracy.str.strip('%').astype(float) / 100
@@ -28,20 +35,97 @@ class WPMScraper(Scraper):
         df = df[["user_id", "Date", "Race #", "Speed", "Accuracy"]]
         df.columns = ["user_id", "race_date", "race_id", "wpm", "accuracy"]
         df.race_id = df.race_id.astype(int)
-        df_to_postgres(df, "wpm", self.conn)
+        return df
+
+    def load_next_date(self, user, user_id, date=None, n=100):
+        df = self.fetch_history(user, user_id, date=date, n=n)
+        if df is None:
+            return False, None
+        self.storage.upsert(df, "wpm")
         next_date = df.tail(1).race_date.iloc[0]
         return True, next_date.strftime("%Y-%m-%d")
 
     def scrape(self, user):
         user_id = self.fetch_or_create_user(user)
+        if self.workers > 1:
+            span = self.date_span(user, user_id)
+            if span:
+                self.scrape_windows(user, user_id, *span)
+                return
         has_next, next_date = self.load_next_date(user, user_id)
         while has_next:
             has_next, next_date = self.load_next_date(user, user_id, date=next_date)
 
+    def date_span(self, user, user_id):
+        """
+        Returns the dates of the user's first and latest races: the latest
+        from the head of their history, the first from the page of race 1.
+        None when either can't be fetched, to fall back to a serial crawl.
+        """
+        try:
+            latest = self.fetch_history(user, user_id, n=1)
+            html = self.http.get(self.base + f'result?id=|tr:{user}|1')
+            first = self.extractor.race_date(html) if html else None
+        except (requests.RequestException, ValueError) as e:
+            print(f"failed to find the date span of {user}: {e}")
+            return None
+        if latest is None or not first or first > latest.race_date.iloc[0]:
+            return None
+        return first.date(), latest.race_date.iloc[0].date()
+
+    def scrape_windows(self, user, user_id, first, latest):
+        """
+        Splits [first, latest] into disjoint date windows and pages through
+        them concurrently. Each window starts one day past its upper edge, so
+        neighbouring windows overlap at the edges; duplicates are dropped
+        before the merged history is written in one COPY.
+        """
+        days = (latest - first).days + 1
+        count = min(4 * self.workers, days)
+        edges = [first + timedelta(days=days * i // count) for i in range(count + 1)]
+        windows = [(lo, hi - timedelta(days=1)) for lo, hi in zip(edges, edges[1:])]
+        crawl = lambda window: self.crawl_window(user, user_id, *window)
+        frames = [df for _, df in bounded_map(crawl, windows, self.workers) if len(df)]
+        if not frames:
+            return
+        df = pd.concat(frames).drop_duplicates(subset=["user_id", "race_id"])
+        print(f"Writing {len(df)} races from {count} windows")
+        self.storage.upsert(df.sort_values("race_date", ascending=False), "wpm")
+
+    def crawl_window(self, user, user_id, lower, upper, n=100):
+        """
+        Pages back through the user's races from the day after upper down
+        to lower. Pages are cursored by date, so a full page that doesn't
+        reach past the day it started from is fetched again with a larger
+        n until it does.
+        """
+        frames = []
+        date = (upper + timedelta(days=1)).strftime("%Y-%m-%d")
+        size = n
+        while date:
+            df = self.fetch_history(user, user_id, date=date, n=size)
+            if df is None:
+                break
+            oldest = df.race_date.iloc[-1]
+            next_date = oldest.strftime("%Y-%m-%d")
+            stuck = next_date == date
+            if stuck and len(df) == size and size < MAX_HISTORY_PAGE:
+                size = min(2 * size, MAX_HISTORY_PAGE)
+                continue
+            if stuck and len(df) == size:
+                print(f"Warning: {user} has more than {size} races on {date}; "
+                      f"older races down to {lower} were skipped")
+            frames.append(df[df.race_date.dt.date >= lower])
+            date = next_date if oldest.date() >= lower and not stuck else None
+            size = n
+        return pd.concat(frames) if frames else pd.DataFrame()
+
 
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("username")
+    arg_parser.add_argument("--workers", type=int, default=1, help="concurrent date windows")
+    add_scraper_arguments(arg_parser)
     args = arg_parser.parse_args()
-    wmps = WPMScraper()
+    wmps = WPMScraper(workers=args.workers, **scraper_kwargs(args))
     wmps.scrape(args.username)